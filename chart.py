@@ -4,8 +4,15 @@
 # Copyright 2014-2016 John K. Hinsdale
 
 from svgtag import *
+from chart_data import chart_data, rebucket
 import re, math
 
+# NumPy is optional, used for computing bar geometry if available
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Default margin
 DEFM = 12
 
@@ -52,6 +59,9 @@ class Chart:
         # Stroke width for axes, bars, border, etc.
         self.stroke_width = 0.75                 # Stroke width
 
+        # Decimal places for coordinates and sizes in the output, None for full precision
+        self.precision = None
+
         # Axis ticks and labels.  There should be a label in the array for every tick implied by tick_sep.
         # Unlaballed ticks have empty label in the array
         self.axis_label_height = 5               # Height of one line of label text for Y axis labels and axis titles (if exist)
@@ -62,24 +72,51 @@ class Chart:
         # Colors
         self.chart_color = "black"           # Color of "chart ink" - axes, ticks, labels, etc.
         self.data_color = "#0099ff"          # Color of "data ink" (content that varies)
+        self.bar_classes = None              # Map of (fill, stroke, stroke width) to CSS class for bars, drawn
+                                             # with the class instead of inline style if set.  See render_style()
 
         # Bar dimensions and spacing
         self.max_chart_aspect = 4            # Maximum width of chart as a multiple of height
         self.preferred_bar_width = 10        # Preferred width of maximum bar in units
         self.bar_width = None                # Actual width of bar, possibly shrunk for max aspect
         self.bar_spacing = .75               # Space between bars, a fraction of bar width
+        self.coalesce_bars = False           # Draw all bars of one color as a single <path>, not a <rect> each
+        self.max_bars = None                 # If set, merge runs of bars so there are at most this many
+        self.bar_reducer = "sum"             # Value of merged bars: "sum", "mean" or "max" of theirs
      
         # Draw box around whole chart?
         self.border = -1                     # Border for whole chart.  None for no border, -1 means default to stroke_width
 
         # Data
-        self.data = []			     # Data points
+        self.data = []			     # Data points, as ChartData or list of dicts
         self.data_max = None                 # Max value of data
-
+        self._columns = None                 # self.data as ChartData
+        self._columns_src = None             # What self._columns was converted from
+        self._columns_key = None             # Length of self.data and bucketing self._columns was made with
+
+
+    # Get data as ChartData, rebucketed to self.max_bars if set.  A list of dicts is
+    # converted once, and converted again only if self.data is replaced or changes
+    # length, or the bucketing changes
+    def columns(self):
+        key = (len(self.data), self.max_bars, self.bar_reducer)
+        if self._columns is None or self._columns_src is not self.data or self._columns_key != key:
+            self._columns = rebucket(chart_data(self.data), self.max_bars, self.bar_reducer)
+            self._columns_src = self.data
+            self._columns_key = key
+        return self._columns
+
+    # Distinct (fill, stroke, stroke width) styles of bars in this chart, as keys of
+    # self.bar_classes
+    def bar_styles(self):
+        result = [(self.data_color, self.chart_color, self.stroke_width)]
+        for c in self.columns().colors:
+            result.append((c, self.chart_color, self.stroke_width))
+        return result
 
     # Size the chart, setting self.x_chart_width and adjusting self.bar_width
     def size_chart(self):
-        ndata = len(self.data)
+        ndata = self.columns().nbars()
 
         # See if already done
         if self.x_chart_width is not None and self.bar_width is not None:
@@ -196,12 +233,13 @@ class Chart:
     # Get style content
     def render_style(self):
         self.size_chart()
-        axth = str(self.stroke_width)
-        tkth = str(self.axis_tick_thickness)
-        ctfs = str(self.y_chart_title_height)
+        f = coord_formatter(self.precision)
+        axth = str(f(self.stroke_width))
+        tkth = str(f(self.axis_tick_thickness))
+        ctfs = str(f(self.y_chart_title_height))
         ctff = self.chart_title_font_family
-        axlfs = str(self.axis_label_height)
-        xaxlfs = str(self.x_axis_label_height)
+        axlfs = str(f(self.axis_label_height))
+        xaxlfs = str(f(self.x_axis_label_height))
         axlff = self.axis_label_font_family
         ccolor = self.chart_color
         dcolor = self.data_color
@@ -212,38 +250,149 @@ class Chart:
         + ".ctitle { font-family: \"" + ctff + "\"; font-size: " + ctfs + "; text-anchor: middle; }\n" \
         + ".axlabel { font-family: \"" + axlff + "\"; font-size: " + axlfs + "; text-anchor: middle; fill: " + ccolor + "; }\n" \
         + ".xaxlabel { font-family: \"" + axlff + "\"; font-size: " + xaxlfs + "; text-anchor: middle; fill: " + ccolor + "; }\n" \
-        + ".yaxlabel { font-family: \"" + axlff + "\"; font-size: " + axlfs + "; text-anchor: start; fill: " + ccolor + "; }\n" \
-        + "</style>"
+        + ".yaxlabel { font-family: \"" + axlff + "\"; font-size: " + axlfs + "; text-anchor: start; fill: " + ccolor + "; }\n"
+        if self.bar_classes:
+            for ((fill, stroke, sw), cls) in sorted(self.bar_classes.items(), key=lambda item: (len(item[1]), item[1])):
+                result += "." + cls + " { fill: " + fill + "; stroke: " + stroke + "; stroke-width: " + str(f(sw)) + "; }\n"
+        result += "</style>"
         return result
 
-    # Render SVG doc
-    def render_svg(self, preserveAspectRatio="none", width=None, height=None, scale=None):
-        elts = []
+    # Render SVG doc.  If out (a file-like sink or SvgWriter) is given the
+    # document is written to it element by element and None is returned,
+    # otherwise it is returned as a string.  If chrome_id is given, the parts that
+    # do not depend on the data (see render_chrome()) are not drawn, and instead
+    # refer to an element with that id holding them.  A standalone document has an
+    # XML declaration, namespace and its own copy of the style, so it can be used
+    # outside of an HTML page.  If stats (a RenderStats) is given, time spent in each
+    # part of the chart is added to it
+    def render_svg(self, preserveAspectRatio="none", width=None, height=None, scale=None, out=None, chrome_id=None,
+                   standalone=False, stats=None):
+        if out is None:
+            sink = StringSink()
+            self.render_svg(preserveAspectRatio=preserveAspectRatio, width=width, height=height, scale=scale, out=sink,
+                            chrome_id=chrome_id, standalone=standalone, stats=stats)
+            return sink.getvalue()
+        w = svg_writer(out)
+        if stats is not None:
+            t = stats.now()
 
-        # Border around whole chart
+        # Top level SVG
+        # Size chart using given dimensions, or implied dimensions, optionally scaled
+        chart_width = self.width()
+        chart_height = self.height()
+        vbox = st_coords(0, 0, chart_width, chart_height, precision=self.precision)
+        if width is None:
+            if scale is not None:
+                svg_width = scale * chart_width
+            else:
+                svg_width = chart_width
+        else:
+            svg_width = width
+        if height is None:
+            if scale is not None:
+                svg_height = chart_height * scale
+            else:
+                svg_height = chart_height
+        else:
+            svg_height = height
+        f = coord_formatter(self.precision)
+        if isinstance(svg_width, (int, long, float)):
+            svg_width = f(svg_width)
+        if isinstance(svg_height, (int, long, float)):
+            svg_height = f(svg_height)
+        if standalone:
+            w.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
+            w.start("svg", xmlns="http://www.w3.org/2000/svg", viewBox=vbox, preserveAspectRatio=preserveAspectRatio,
+                    width=svg_width, height=svg_height)
+            w.write(self.render_style(), "\n")
+        else:
+            w.start("svg", viewBox=vbox, preserveAspectRatio=preserveAspectRatio, width=svg_width, height=svg_height)
+        if stats is not None:
+            t = stats.phase("chart.layout", t)
+        if chrome_id is None:
+            self._render_border(w)
+            self._render_chart_title(w)
+            self._render_axis_titles(w)
+            self._render_axes(w)
+            if stats is not None:
+                t = stats.phase("chart.chrome", t)
+            self._render_bars(w, True, True)
+            if stats is not None:
+                t = stats.phase("chart.bars", t)
+            self._render_y_axis_labels(w)
+            if stats is not None:
+                stats.phase("chart.y_labels", t)
+        else:
+            w.write(st_use(href="#" + chrome_id))
+            self._render_chart_title(w)
+            if stats is not None:
+                t = stats.phase("chart.chrome", t)
+            self._render_bars(w, True, False)
+            if stats is not None:
+                stats.phase("chart.bars", t)
+        w.end()
+
+    # Write chart as a standalone gzip-compressed SVG (.svgz) to f, a file name or
+    # file object.  level is the zlib compression level
+    def write_svgz(self, f, level=9, preserveAspectRatio="none", width=None, height=None, scale=None):
+        if isinstance(f, basestring):
+            with open(f, "wb") as fobj:
+                self.write_svgz(fobj, level=level, preserveAspectRatio=preserveAspectRatio, width=width, height=height,
+                                scale=scale)
+            return
+        sink = GzipSink(f, level=level)
+        self.render_svg(preserveAspectRatio=preserveAspectRatio, width=width, height=height, scale=scale, out=sink,
+                        standalone=True)
+        sink.close()
+
+    # Render the parts of the chart that do not depend on its data values or
+    # title: border, axes and their titles, X axis labels and Y axis labels and
+    # ticks.  Charts of the same size, labels and data_max have the same chrome, so
+    # it can be drawn once and shared.  Returns string if out is not given
+    def render_chrome(self, out=None):
+        if out is None:
+            sink = StringSink()
+            self.render_chrome(out=sink)
+            return sink.getvalue()
+        w = svg_writer(out)
+        self._render_border(w)
+        self._render_axis_titles(w)
+        self._render_axes(w)
+        self._render_bars(w, False, True)
+        self._render_y_axis_labels(w)
+
+    # Border around whole chart
+    def _render_border(self, w):
         sw = self.border
         if sw is not None:
             if sw < 0:
                 sw = self.stroke_width
-            elts.append(st_rect(x=sw/2.0, y=sw/2.0, width=self.width() - sw*2, height=self.height() - sw*2,
-                                stroke=self.chart_color, fill="none", stroke_width=sw))
+            f = coord_formatter(self.precision)
+            w.write(st_rect(x=f(sw/2.0), y=f(sw/2.0), width=f(self.width() - sw*2), height=f(self.height() - sw*2),
+                                stroke=self.chart_color, fill="none", stroke_width=f(sw)))
 
-        # Chart title lines
+    # Chart title lines
+    def _render_chart_title(self, w):
         if self.chart_title:
             y = self.y_loc_chart_title()
             x = self.x_loc_chart_center()
             chart_title_lines = _label_lines(self.chart_title)
+            f = coord_formatter(self.precision)
             for line in chart_title_lines:
-                elts.append(st_text(line, _class="ctitle", x=x, y=y, fill=self.data_color))
+                w.write(st_text(line, _class="ctitle", x=f(x), y=f(y), fill=self.data_color))
                 y += self.y_chart_title_height
 
+    # Axis titles
+    def _render_axis_titles(self, w):
+        f = coord_formatter(self.precision)
+
         # Y axis title lines
         if self.y_axis_title:
             y = self.y_loc_y_axis_title()
             x = self.x_loc_y_axis_label()
             y_axis_title_lines = _label_lines(self.y_axis_title)
             for line in y_axis_title_lines:
-                elts.append(st_text(line, _class="yaxlabel", x=x, y=y))
+                w.write(st_text(line, _class="yaxlabel", x=f(x), y=f(y)))
                 y += self.axis_label_height
 
         # X axis title
@@ -252,65 +401,146 @@ class Chart:
             x = self.x_loc_chart_center()
             x_axis_title_lines = _label_lines(self.x_axis_title)
             for line in x_axis_title_lines:
-                elts.append(st_text(line, _class="axlabel", x=x, y=y))
+                w.write(st_text(line, _class="axlabel", x=f(x), y=f(y)))
                 y += self.axis_label_height
 
+    # Axis lines
+    def _render_axes(self, w):
+        f = coord_formatter(self.precision)
+
         # X axis line
         x1 = self.x_loc_y_axis() - self.stroke_width / 2.0
         y1 = y2 = self.y_loc_x_axis()
         x2 = self.x_loc_chart_right()
-        elts.append(st_line(_class="axis", x1=x1, y1=y1, x2=x2, y2=y2))
+        w.write(st_line(_class="axis", x1=f(x1), y1=f(y1), x2=f(x2), y2=f(y2)))
         
         # Y axis line
         x1 = x2 = self.x_loc_y_axis()
         y1 = self.y_loc_chart_top()
         y2 = self.y_loc_x_axis() + self.stroke_width / 2.0
-        elts.append(st_line(_class="axis", x1=x1, y1=y1, x2=x2, y2=y2))
-        
-        # Data bars
+        w.write(st_line(_class="axis", x1=f(x1), y1=f(y1), x2=f(x2), y2=f(y2)))
+
+    # Data bars and/or X axis labels
+    def _render_bars(self, w, bars, labels):
         # Get max data (if not already set explicity)
+        cols = self.columns()
         if self.data_max is None:
-            for d in self.data:
-                v = _data_value(d)
-                if self.data_max is None or v > self.data_max:
-                    self.data_max = v
-                
+            self.data_max = cols.max_value()
+
         # Draw bars, scaled so that self.data_max extends up to self.y_chart_height
-        # Also draw X axis labels
+        # Also draw X axis labels.  Geometry for all bars is computed up front.  For
+        # sparse data, bar positions are looked up by slot
         spacing_width = self.bar_spacing * self.bar_width
         x_y_axis = self.x_loc_y_axis()
         y_x_axis = self.y_loc_x_axis()
         y_x_axis_label = self.y_loc_x_axis_label()
-        curx = x_y_axis + spacing_width
+        nbars = cols.nbars()
+        (slot_xs, centers) = _bar_positions(x_y_axis + spacing_width, spacing_width + self.bar_width, self.bar_width, nbars)
+        (ys, heights) = _bar_heights(cols.values, y_x_axis, self.data_max, self.y_chart_height)
+        slots = None
+        xs = slot_xs
+        if cols.sparse:
+            slots = cols.label_ids
+            xs = [slot_xs[s] for s in slots]
         cc = self.chart_color
         bsw = self.stroke_width
-        for d in self.data:
-            v = _data_value(d)
-            fill = _data_color(d)
-            if fill is None:
-                fill = self.data_color
-            if v is not None:
-                bar_height = (v / self.data_max) * self.y_chart_height
-                y = y_x_axis - bar_height
-                elts.append(st_rect(x=curx, y=y, width=self.bar_width, height=bar_height, fill=fill, stroke=cc, stroke_width=bsw))
+        bw = self.bar_width
+        f = coord_formatter(self.precision)
+        if self.precision is not None:
+            bsw = f(bsw)
+            bw = f(bw)
+            xs = [f(x) for x in xs]
+            ys = [f(y) if y == y else y for y in ys]
+        fills = cols.colors
+        default_fill = self.data_color
+        if self.bar_classes is not None:
+            # Bars refer to a class for their fill and stroke
+            fills = [self.bar_classes[(c, cc, self.stroke_width)] for c in fills]
+            default_fill = self.bar_classes[(default_fill, cc, self.stroke_width)]
+            bar_rect = svg_template("rect", False, ("x", "y", "width", "height", "_class"))
+        else:
+            bar_rect = svg_template("rect", False, ("x", "y", "width", "height", "fill", "stroke", "stroke_width"),
+                                    {"stroke": cc, "stroke_width": bsw})
+        color_ids = cols.color_ids
+        def draw_bar(i):
+            bar_height = heights[i]
+            if bar_height == bar_height:
+                c = color_ids[i]
+                w.write(bar_rect(xs[i], ys[i], bw, f(bar_height), fills[c] if c >= 0 else default_fill))
+
+        if bars and self.coalesce_bars:
+            self._render_bar_paths(w, cols, xs, ys, heights)
+            bars = False
+        if not labels:
+            if bars:
+                for i in range(0, len(xs)):
+                    draw_bar(i)
+            return
+
+        # Bars interleaved with X axis labels, at bar centers
+        xlabel_text = svg_template("text", True, ("_class", "x", "y"), {"_class": "xaxlabel"})
+        label_lines = [_label_lines(l) for l in cols.labels]
+        label_ys = [y_x_axis_label]
+        for k in range(1, max([len(lines) for lines in label_lines] + [1])):
+            label_ys.append(label_ys[-1] + self.x_axis_label_height)
+        if self.precision is not None:
+            label_ys = [f(y) for y in label_ys]
+            centers = [f(x) for x in centers]
+        label_ids = cols.label_ids
+        nentries = len(xs)
+        i = 0
+        for p in range(0, nbars):
+            if slots is None:
+                if bars:
+                    draw_bar(p)
+                lines = label_lines[label_ids[p]]
+            else:
+                while i < nentries and slots[i] == p:
+                    if bars:
+                        draw_bar(i)
+                    i += 1
+                lines = label_lines[p]
 
             # Draw X axis label at rectangle center
-            rect_center = curx + self.bar_width / 2.0
-            xlabel = _data_label(d)
-            xlabel_lines = _label_lines(xlabel)
-            label_y = y_x_axis_label
-            for label_line in xlabel_lines:
-                elts.append(st_text(label_line, _class="xaxlabel", x=rect_center, y=label_y))
-                label_y += self.x_axis_label_height
-
-            # Advance X value
-            curx += spacing_width + self.bar_width
-            
-        # Draw Y axis labels and ticks
+            rect_center = centers[p]
+            k = 0
+            for label_line in lines:
+                w.write(xlabel_text(rect_center, label_ys[k], label_line))
+                k += 1
+
+    # Data bars as one <path> per fill color, each bar a closed subpath, so the
+    # number of elements does not grow with the number of bars.  Coordinates in xs
+    # and ys are already formatted
+    def _render_bar_paths(self, w, cols, xs, ys, heights):
+        paths = {}
+        order = []
+        f = coord_formatter(self.precision)
+        bw = f(self.bar_width)
+        color_ids = cols.color_ids
+        for i in range(0, len(xs)):
+            bar_height = heights[i]
+            if bar_height == bar_height:
+                c = color_ids[i]
+                if c not in paths:
+                    paths[c] = []
+                    order.append(c)
+                paths[c].append("M%s %sh%sv%sh-%sz" % (xs[i], ys[i], bw, f(bar_height), bw))
+        for c in order:
+            fill = cols.colors[c] if c >= 0 else self.data_color
+            if self.bar_classes is not None:
+                w.write(st_path(d="".join(paths[c]), _class=self.bar_classes[(fill, self.chart_color, self.stroke_width)]))
+            else:
+                w.write(st_path(d="".join(paths[c]), fill=fill, stroke=self.chart_color, stroke_width=f(self.stroke_width)))
+
+    # Y axis labels and ticks
+    def _render_y_axis_labels(self, w):
         (y_incr, y_labels) = _axis_labels_for_max(self.data_max)
         cur_val = y_incr
         x_label = self.x_loc_y_axis_label()
         x_tick = self.x_loc_y_axis_tick()
+        x_y_axis = self.x_loc_y_axis()
+        y_x_axis = self.y_loc_x_axis()
+        f = coord_formatter(self.precision)
         i = 0
         for y_label in y_labels:
             if cur_val > self.data_max:
@@ -320,38 +550,14 @@ class Chart:
             y_offset = cur_val * self.y_chart_height / self.data_max
             y_tick = y_x_axis - y_offset
             y_lb = y_tick + (self.axis_label_height / 2.0)
-            elts.append(st_text(y_label, _class="yaxlabel", x=x_label, y=y_lb))
+            w.write(st_text(y_label, _class="yaxlabel", x=f(x_label), y=f(y_lb)))
 
             # Draw Y axis tick, but not the last one
-            elts.append(st_line(_class="tick", x1=x_tick, y1=y_tick, x2=x_y_axis, y2=y_tick))
+            w.write(st_line(_class="tick", x1=f(x_tick), y1=f(y_tick), x2=f(x_y_axis), y2=f(y_tick)))
 
             # Advance to next tick value
             cur_val += y_incr
 
-
-        # Top level SVG
-        # Size chart using given dimensions, or implied dimensions, optionally scaled
-        chart_width = self.width()
-        chart_height = self.height()
-        vbox = st_coords(0, 0, chart_width, chart_height)
-        if width is None:
-            if scale is not None:
-                svg_width = scale * chart_width
-            else:
-                svg_width = chart_width
-        else:
-            svg_width = width
-        if height is None:
-            if scale is not None:
-                svg_height = chart_height * scale
-            else:
-                svg_height = chart_height
-        else:
-            svg_height = height
-        
-        result = st_svg(elts, viewBox=vbox, preserveAspectRatio=preserveAspectRatio, width=svg_width, height=svg_height)
-        return result
-
     # Count chart title lines
     def count_y_chart_title_lines(self):
         if self.y_chart_title_lines is not None:
@@ -378,8 +584,7 @@ class Chart:
         if self.y_x_axis_label_lines is not None:
             return self.y_x_axis_label_lines
         max_height = 0
-        for d in self.data:
-            l = _data_label(d)
+        for l in self.columns().labels:
             h = string_height(l)
             if h > max_height:
                 max_height = h
@@ -388,21 +593,44 @@ class Chart:
 
 # -=-=-=-=-=-=-=-=-=-=-=-=-=-=   Private routines -=-=-=-=-=-=-=-=-=-=-=-=-=-=
 
-# Get numeric value of data pont
-def _data_value(d):
-    if "value" not in d or d["value"] is None:
-        return None
-    return float(d["value"])
-
-# Get label for data point
-def _data_label(d):
-    return d["label"]
-
-# Get color for data point
-def _data_color(d):
-    if "color" in d:
-        return d["color"]
-    return None
+# Compute X positions of nbars bars at once: lists of bar X (left) and X center.
+# Bars start at x0 and are step apart.  All multiples share these, so the last
+# result is kept
+_positions_cache = {}
+
+def _bar_positions(x0, step, bar_width, nbars):
+    key = (x0, step, bar_width, nbars)
+    if key in _positions_cache:
+        return _positions_cache[key]
+    if nbars == 0:
+        return ([], [])
+    half = bar_width / 2.0
+    if numpy is not None:
+        xs = numpy.empty(nbars)
+        xs.fill(step)
+        xs[0] = x0
+        xs = numpy.add.accumulate(xs)
+        result = (xs.tolist(), (xs + half).tolist())
+    else:
+        xs = [x0] * nbars
+        for i in range(1, nbars):
+            xs[i] = xs[i-1] + step
+        result = (xs, [x + half for x in xs])
+    _positions_cache.clear()
+    _positions_cache[key] = result
+    return result
+
+# Compute bar Y (top) and height for all values at once.  Values are scaled so
+# data_max is chart_height and drawn up from y_base.  NaN for missing values
+def _bar_heights(values, y_base, data_max, chart_height):
+    if len(values) == 0:
+        return ([], [])
+    if numpy is not None:
+        v = numpy.frombuffer(values, dtype=numpy.float64)
+        heights = (v / data_max) * chart_height
+        return ((y_base - heights).tolist(), heights.tolist())
+    heights = [(v / data_max) * chart_height for v in values]
+    return ([y_base - h for h in heights], heights)
 
 # Normalize newlines, mapping multiple \r\n's into a single \n
 def _normalize_newlines(s):
@@ -0,0 +1,233 @@
+#
+# chart_data.py -- Column-oriented chart data
+#
+# Copyright 2014-2016 John K. Hinsdale
+
+from array import array
+import re
+
+# Value of missing data points
+NAN = float("nan")
+
+class ChartData:
+    """Chart data, stored by column"""
+
+    def __init__(self, labels=None, label_ids=None, values=None, colors=None, color_ids=None, sparse=False):
+
+        # Labels and colors are interned: each distinct one is stored once, and data
+        # points refer to it by index
+        self.labels = labels if labels is not None else []         # Distinct labels
+        self.colors = colors if colors is not None else []         # Distinct per-item colors
+
+        # One entry per data point
+        self.label_ids = label_ids if label_ids is not None else array('i')    # Index into self.labels
+        self.values = values if values is not None else array('d')             # Value, NaN if missing
+        self.color_ids = color_ids if color_ids is not None else array('i')    # Index into self.colors, -1 if none
+
+        # If sparse, labels are all bars along the X axis, and only the data points
+        # present are stored, in label order.  A bar with no data point is missing
+        self.sparse = sparse
+
+        # Lookups for interning, built when first needed
+        self._label_index = None
+        self._color_index = None
+
+    def __len__(self):
+        return len(self.values)
+
+    # Number of bars along the X axis
+    def nbars(self):
+        if self.sparse:
+            return len(self.labels)
+        return len(self.values)
+
+    # Add a data point.  A value of None is a missing data point
+    def append(self, label, value=None, color=None):
+        self.label_ids.append(self.label_id(label))
+        if value is None:
+            self.values.append(NAN)
+        else:
+            self.values.append(float(value))
+        if color is None:
+            self.color_ids.append(-1)
+        else:
+            self.color_ids.append(self.color_id(color))
+
+    # Get id of label, adding it to the label table if new
+    def label_id(self, label):
+        if self._label_index is None:
+            self._label_index = _index(self.labels)
+        i = self._label_index.get(label)
+        if i is None:
+            i = self._label_index[label] = len(self.labels)
+            self.labels.append(label)
+        return i
+
+    # Get id of color, adding it to the color table if new
+    def color_id(self, color):
+        if self._color_index is None:
+            self._color_index = _index(self.colors)
+        i = self._color_index.get(color)
+        if i is None:
+            i = self._color_index[color] = len(self.colors)
+            self.colors.append(color)
+        return i
+
+    # Value of i'th data point, None if missing
+    def value(self, i):
+        v = self.values[i]
+        if v != v:
+            return None
+        return v
+
+    # Label of i'th data point
+    def label(self, i):
+        return self.labels[self.label_ids[i]]
+
+    # Color of i'th data point, None if it has none of its own
+    def color(self, i):
+        c = self.color_ids[i]
+        if c < 0:
+            return None
+        return self.colors[c]
+
+    # Labels of data points, in order
+    def label_seq(self):
+        labels = self.labels
+        return [labels[i] for i in self.label_ids]
+
+    # Maximum value, None if no data
+    def max_value(self):
+        result = None
+        for v in self.values:
+            if v == v and (result is None or v > result):
+                result = v
+        return result
+
+    # Total of values
+    def total(self):
+        result = 0
+        for v in self.values:
+            if v == v:
+                result += v
+        return result
+
+    # Data points as list of dicts, as accepted by chart_data()
+    def items(self):
+        result = []
+        for i in range(0, len(self)):
+            item = {"label": self.label(i), "value": self.value(i)}
+            c = self.color(i)
+            if c is not None:
+                item["color"] = c
+            result.append(item)
+        return result
+
+# Get data as ChartData.  Data may already be ChartData, or a list of dicts
+# with "label", "value" and optionally "color", which is converted
+def chart_data(data):
+    if isinstance(data, ChartData):
+        return data
+    result = ChartData()
+    for d in data:
+        value = d.get("value")
+        result.append(d["label"], value, d.get("color"))
+    return result
+
+# Ways rebucket() can combine the values of bars merged into one
+REDUCERS = ("sum", "mean", "max")
+
+# Rebucket data into at most max_bars bars along the X axis, each bucket taking
+# the same number of consecutive bars (the last may take fewer).  A bucket's
+# value is the sum, mean or max (reducer) of the values of its data points,
+# ignoring missing ones; its label spans its first and last bars' labels (see
+# bucket_labels()); and it keeps a per-item color only if all its data points
+# have the same one.  Returns sparse data over the buckets, or data itself if
+# it already fits.  labels, if given, are bucket_labels() of data's X axis
+def rebucket(data, max_bars, reducer="sum", labels=None):
+    nbars = data.nbars()
+    if max_bars is None or nbars <= max_bars:
+        return data
+    if reducer not in REDUCERS:
+        raise Exception("Unknown bar reducer: " + str(reducer))
+    if labels is None:
+        labels = bucket_labels(data.labels if data.sparse else data.label_seq(), max_bars)
+    size = _bucket_size(nbars, max_bars)
+
+    # Data points are in X axis order, so each bucket is a run of them
+    slots = data.label_ids if data.sparse else range(0, len(data))
+    values = data.values
+    color_ids = data.color_ids
+    result = ChartData(labels=labels, colors=data.colors, sparse=True)
+    cur = -1
+    for i in range(0, len(values)):
+        v = values[i]
+        if v != v:
+            continue
+        bucket = slots[i] // size
+        if bucket != cur:
+            if cur >= 0:
+                _add_bucket(result, cur, acc, n, color, reducer)
+            cur = bucket
+            acc = v
+            n = 1
+            color = color_ids[i]
+            continue
+        if reducer == "max":
+            if v > acc:
+                acc = v
+        else:
+            acc += v
+        n += 1
+        if color_ids[i] != color:
+            color = -1
+    if cur >= 0:
+        _add_bucket(result, cur, acc, n, color, reducer)
+    return result
+
+# Labels of buckets of at most max_bars bars along an X axis with labels.  A
+# bucket of several bars is labelled "first-last" line by line, where its first
+# and last bars' labels differ, or "first - last" on one line if they have
+# different numbers of lines
+def bucket_labels(labels, max_bars):
+    if max_bars < 1:
+        raise Exception("Need at least one bar")
+    size = _bucket_size(len(labels), max_bars)
+    result = []
+    for start in range(0, len(labels), size):
+        result.append(_span_label(labels[start], labels[min(start + size, len(labels)) - 1]))
+    return result
+
+# Bars per bucket to fit nbars into at most max_bars
+def _bucket_size(nbars, max_bars):
+    return (nbars + max_bars - 1) // max_bars
+
+# Add data point for bucket holding n values that reduce to acc
+def _add_bucket(cdata, bucket, acc, n, color, reducer):
+    cdata.label_ids.append(bucket)
+    cdata.values.append(acc / n if reducer == "mean" else acc)
+    cdata.color_ids.append(color)
+
+# Label spanning labels first and last, line by line.  Labels of different
+# shape are spanned whole, on one line
+def _span_label(first, last):
+    if first == last:
+        return first
+    a = re.split("[\\r\\n]+", first)
+    b = re.split("[\\r\\n]+", last)
+    if len(a) != len(b):
+        return " ".join(a) + " - " + " ".join(b)
+    lines = []
+    for k in range(0, len(a)):
+        if a[k] == b[k]:
+            lines.append(a[k])
+        else:
+            lines.append(a[k] + "-" + b[k])
+    return "\n".join(lines)
+
+# Map list items to their indexes
+def _index(items):
+    result = {}
+    for i in range(0, len(items)):
+        result[items[i]] = i
+    return result
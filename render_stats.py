@@ -0,0 +1,69 @@
+#
+# render_stats.py -- Timings and counts of rendering
+#
+# Copyright 2014-2016 John K. Hinsdale
+
+import re, time
+
+# Start of an element, with its tag
+_element_re = re.compile(r"<([a-zA-Z][\w:]*)")
+
+class RenderStats:
+    """Render statistics"""
+
+    def __init__(self):
+        self.times = {}         # Seconds by phase
+        self.counts = {}        # Count by item, e.g. charts
+        self.elements = {}      # Elements written by tag
+        self.bytes = 0          # Bytes written
+
+    # Current time, to time a phase from
+    def now(self):
+        return time.time()
+
+    # Add time since t to phase, returning the current time to time the next phase from
+    def phase(self, name, t):
+        now = time.time()
+        self.times[name] = self.times.get(name, 0.0) + (now - t)
+        return now
+
+    # Add n to count of item
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    # Count elements and bytes of output s
+    def output(self, s):
+        self.bytes += len(s)
+        elements = self.elements
+        for tag in _element_re.findall(s):
+            elements[tag] = elements.get(tag, 0) + 1
+
+    # Sink passing what is written on to out, a file-like sink or SvgWriter, and counting it
+    def sink(self, out):
+        return StatsSink(out, self)
+
+    # Write report to file f, one line per statistic
+    def report(self, f):
+        for name in sorted(self.times):
+            f.write("time      %-20s %10.6f\n" % (name, self.times[name]))
+        for name in sorted(self.counts):
+            f.write("count     %-20s %10d\n" % (name, self.counts[name]))
+        for tag in sorted(self.elements):
+            f.write("elements  %-20s %10d\n" % (tag, self.elements[tag]))
+        f.write("bytes     %-20s %10d\n" % ("", self.bytes))
+
+# Sink counting what is written to it in stats, then passing it on to out
+class StatsSink:
+    """Counting sink"""
+
+    def __init__(self, out, stats):
+        self.out = out
+        self.stats = stats
+
+    def write(self, s):
+        self.stats.output(s)
+        self.out.write(s)
+
+    def flush(self):
+        if hasattr(self.out, "flush"):
+            self.out.flush()
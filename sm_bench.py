@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# Copyright 2014-2016 John K. Hinsdale
+
+from small_multi import render_small_multiples, merge_labels
+from chart_data import chart_data
+from chart import Chart
+import sys
+import argparse
+import json
+import random
+import time
+import multiprocessing
+
+# Peak memory is traced if possible, otherwise taken from the process, which
+# needs resource (not on Windows)
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Benchmark scenarios.  Data is generated from a seeded random number generator
+# for "subjects" charts over "labels" X labels, each data point missing with
+# probability "sparsity" and colored with probability "colored"; labels have
+# "label_lines" lines.  Remaining keys are passed to render_small_multiples.
+# "mix" and "single" are the scenarios of the old sm_test.py and stest.py
+SCENARIOS = [
+    {"name": "small", "subjects": 20, "labels": 12},
+    {"name": "mix", "data": "mix", "preserve_order": True,
+     "chart_opts": {"x_axis_title": "Assessment Outcome\nSource: foobar\nAnd toher", "y_axis_title": "% Students",
+                    "preferred_bar_width": 30, "bar_spacing": .3}},
+    {"name": "time", "subjects": 20, "labels": 3, "sparsity": 0.2, "colored": 0.5, "label_lines": 2, "totals": True,
+     "chart_opts": {"x_axis_title": "Assessment period", "y_axis_title": "Correct answers"}},
+    {"name": "single", "data": "single"},
+    {"name": "many_subjects", "subjects": 2000, "labels": 24, "sparsity": 0.2},
+    {"name": "many_labels", "subjects": 40, "labels": 1000, "sparsity": 0.1},
+    {"name": "sparse", "subjects": 400, "labels": 600, "sparsity": 0.95},
+    {"name": "multiline", "subjects": 100, "labels": 40, "label_lines": 3, "colored": 0.3},
+    {"name": "top", "subjects": 5000, "labels": 50, "sparsity": 0.5, "top": 20, "totals": True},
+    {"name": "wide", "subjects": 40, "labels": 5000, "sparsity": 0.1, "max_bars": 100, "bar_reducer": "mean"},
+]
+
+# Options of render_small_multiples a scenario may set
+_render_opts = ["scale", "totals", "sort", "top", "preserve_order", "chart_opts", "workers", "shared_chrome", "bar_classes",
+                "max_bars", "bar_reducer"]
+
+# Time metrics, lower is better.  Changes in time smaller than NOISE seconds are
+# not counted as slower
+TIMES = ["merge_labels", "render_svg", "render_small_multiples"]
+NOISE = 0.002
+
+# Run benchmarks and write results as JSON, optionally comparing them to a baseline
+def main(argv):
+
+    # Parse args
+    ap = argparse.ArgumentParser(description='Benchmark rendering of small multiple charts.')
+    ap.add_argument("-s", "--scenario", metavar="name", action="append",
+                    help="run scenario (repeatable, default all): " + ", ".join([sc["name"] for sc in SCENARIOS]))
+    ap.add_argument("-r", "--repeat", metavar="N", type=int, default=3, help="time best of N runs (default 3)")
+    ap.add_argument("-sd", "--seed", metavar="N", type=int, default=1, help="seed data generation with N (default 1)")
+    ap.add_argument("-o", "--output", metavar="fn", help="write results to fn as well as stdout")
+    ap.add_argument("-b", "--baseline", metavar="fn", help="compare results to those stored in fn")
+    ap.add_argument("-tol", "--tolerance", metavar="frac", type=float, default=0.1,
+                    help="with --baseline, fail if a time is slower by more than frac (default 0.1)")
+    args = ap.parse_args()
+
+    scenarios = SCENARIOS
+    if args.scenario:
+        by_name = dict([(sc["name"], sc) for sc in SCENARIOS])
+        for name in args.scenario:
+            if name not in by_name:
+                ap.error("unknown scenario " + name)
+        scenarios = [by_name[name] for name in args.scenario]
+
+    # Run each scenario in a fresh process, so memory and timings are its own
+    results = {}
+    for sc in scenarios:
+        pool = multiprocessing.Pool(1)
+        try:
+            results[sc["name"]] = pool.apply(run_scenario, (sc, args.seed, args.repeat))
+        finally:
+            pool.terminate()
+            pool.join()
+    report = {"seed": args.seed, "repeat": args.repeat, "python": sys.version.split()[0], "scenarios": results}
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print text
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    # Exit status is 1 if slower than baseline
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.tolerance):
+            return 1
+    return 0
+
+# Run scenario, returning its metrics.  Times are the best of repeat runs, each
+# on freshly generated data
+def run_scenario(sc, seed, repeat):
+    result = {}
+    for i in range(0, repeat):
+        for (metric, secs) in time_scenario(sc, seed).iteritems():
+            if metric not in result or secs < result[metric]:
+                result[metric] = secs
+
+    # Memory and output of one more run
+    if tracemalloc is not None:
+        tracemalloc.start()
+    out = render_scenario(sc, generate(sc, seed))
+    if tracemalloc is not None:
+        result["peak_memory_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    elif resource is not None:
+        result["peak_memory_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["bytes"] = len(out)
+    result["elements"] = out.count("<") - out.count("</")
+    return result
+
+# Time phases of scenario on data generated with seed
+def time_scenario(sc, seed):
+    result = {}
+    data = generate(sc, seed)
+    cdatas = [chart_data(cinf["data"]) for cinf in data]
+    start = time.time()
+    merge_labels(cdatas, preserve_order=sc.get("preserve_order", False))
+    result["merge_labels"] = time.time() - start
+
+    # Single chart, as given by the first subject
+    chart = make_chart(sc, data[0])
+    start = time.time()
+    chart.render_svg(width=1000, height=800, preserveAspectRatio="xMinYMin")
+    result["render_svg"] = time.time() - start
+
+    data = generate(sc, seed)
+    start = time.time()
+    render_scenario(sc, data)
+    result["render_small_multiples"] = time.time() - start
+    return result
+
+# Render scenario data, returning the output
+def render_scenario(sc, data):
+    if sc.get("data") == "single":
+        # Style and chart three times over, as stest.py did
+        chart = make_chart(sc, data[0])
+        out = chart.render_style()
+        for i in range(0, 3):
+            out += chart.render_svg(width=1000, height=800, preserveAspectRatio="xMinYMin")
+        return out
+    opts = dict([(k, sc[k]) for k in _render_opts if k in sc])
+    return render_small_multiples(data, None, None, "xMinYMin", **opts)
+
+# Chart for chart info of scenario
+def make_chart(sc, cinf):
+    chart = Chart()
+    chart.chart_title = cinf["title"]
+    chart.data = cinf["data"]
+    for k, v in cinf.get("chart_opts", sc.get("chart_opts", {})).iteritems():
+        setattr(chart, k, v)
+    if "max_bars" in sc:
+        chart.max_bars = sc["max_bars"]
+        chart.bar_reducer = sc.get("bar_reducer", "sum")
+    return chart
+
+# Generate data for scenario with seed, as chart infos
+def generate(sc, seed):
+    rng = random.Random(seed)
+    kind = sc.get("data", "random")
+    if kind == "mix":
+        return generate_mix(rng)
+    if kind == "single":
+        return generate_single(rng)
+    return generate_random(rng, sc["subjects"], sc["labels"], sc.get("sparsity", 0.0), sc.get("colored", 0.0),
+                           sc.get("label_lines", 1))
+
+# Charts of random values
+def generate_random(rng, nsubjects, nlabels, sparsity, colored, label_lines):
+    labels = []
+    for x in range(0, nlabels):
+        label = "X" + str(x)
+        for k in range(1, label_lines):
+            label += "\nLine " + str(k)
+        labels.append(label)
+    data = []
+    for i in range(0, nsubjects):
+        cdata = []
+        # Max value for individual chart varies
+        cmax = rng.uniform(1, 5000)
+        for x in range(0, nlabels):
+            if rng.random() < sparsity:
+                continue
+            item = {"value": int(rng.uniform(0, cmax)), "label": labels[x]}
+            if rng.random() < colored:
+                item["color"] = "red"
+            cdata.append(item)
+        data.append({"title": "Chart #" + str(i), "data": cdata})
+    return data
+
+# Charts of proficiency mix by class, three colored bars each
+def generate_mix(rng):
+    titles = ["Mrs.\nCooke", "Mr. Reynolds", "Ms. Chang", "Mrs. Russell", "Mr. Norman",
+              "Ms. Janet", "Mrs. Williams", "Ms. O'Donnell", "Mrs. Melnick", "Ms. Boren",
+              "Ms. Angela", "Mrs. Zeist", "Mr. Manning", "Ms. Ottavio", "Ms. Yu",
+              "Mrs. Somnowitcz", "Ms. Yurkisian", "Mr. Fischer", "Ms. Ramanathan", "Mrs. Pulian",
+              ]
+    data = []
+    for title in titles:
+        pct_ok = rng.uniform(30, 95)
+        pct_border = rng.uniform(20, 100 - pct_ok)
+        pct_fail = 100 - pct_ok - pct_border
+        cdata = [{"value": pct_fail, "label": "Not\nProficient", "color": "#e00000"},
+                 {"value": pct_border, "label": "Somewhat\nProficient", "color": "#e0e000"},
+                 {"value": pct_ok, "label": "Proficient", "color": "#00e000"}]
+        data.append({"title": title, "data": cdata})
+    data.sort(key=lambda cinf: -(cinf["data"][2]["value"] * 1.5 + cinf["data"][1]["value"]))
+    return data
+
+# One chart of 20 bars with three-line labels
+def generate_single(rng):
+    m = rng.uniform(1, 1000000)
+    cdata = [{"value": rng.uniform(1, m), "label": "2011\nBOY\nP" + str(i)} for i in range(0, 20)]
+    return [{"title": "Sherry Halford", "data": cdata,
+             "chart_opts": {"y_axis_title": "Correct answers", "x_axis_title": "Assessment Period", "max_chart_aspect": 2}}]
+
+# Print comparison of results to baseline, returning True if any time is slower
+# by more than tolerance
+def compare(baseline, report, tolerance):
+    slower = False
+    print >>sys.stderr, "%-16s %-24s %12s %12s %8s" % ("scenario", "metric", "baseline", "now", "change")
+    for name in sorted(report["scenarios"]):
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        now = report["scenarios"][name]
+        for metric in sorted(now):
+            if metric not in base:
+                continue
+            change = (float(now[metric]) / base[metric] - 1) if base[metric] else 0.0
+            flag = ""
+            if metric in TIMES and change > tolerance and now[metric] - base[metric] > NOISE:
+                flag = "  SLOWER"
+                slower = True
+            print >>sys.stderr, "%-16s %-24s %12.6g %12.6g %+7.1f%%%s" % (name, metric, base[metric], now[metric], change * 100, flag)
+    return slower
+
+# Do it
+sys.exit(main(sys.argv))
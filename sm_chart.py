@@ -3,6 +3,11 @@
 
 from small_multi import render_small_multiples, num_disp
 from html import *
+from svgtag import GzipSink
+from sm_input import read_subject_data, load_map_file, AGGREGATES
+from smcol import load_columnar
+from chart_data import REDUCERS
+from render_stats import RenderStats
 import sys
 import argparse
 
@@ -43,62 +48,59 @@ def main(argv):
                     help="try to preserve input order of X labels")
     ap.add_argument("-nl", "--newline",
                     metavar="str", help="use str as newline escape as well as \\n")
+    ap.add_argument("-i", "--input",
+                    metavar="fn", help="read columnar data file fn, made by sm_convert.py, instead of stdin")
+    ap.add_argument("-a", "--aggregate", choices=AGGREGATES,
+                    help="fold rows with the same subject and X value into their sum, count, mean or max")
+    ap.add_argument("-z", "--compress", action="store_true",
+                    help="gzip output as it is produced")
+    ap.add_argument("-zl", "--compress-level",
+                    metavar="N", type=int, default=6, help="use gzip compression level N (default 6)")
+    ap.add_argument("-zf", "--flush-bytes",
+                    metavar="N", type=int, help="flush compressed output after every N bytes of input")
+    ap.add_argument("-j", "--workers",
+                    metavar="N", type=int, help="render charts in N processes")
+    ap.add_argument("-pr", "--precision",
+                    metavar="N", type=int, help="round coordinates to N decimal places")
+    ap.add_argument("-cb", "--coalesce-bars", action="store_true",
+                    help="draw bars of each color as a single path")
+    ap.add_argument("-bc", "--bar-classes", action="store_true",
+                    help="style bars with a CSS class per color")
+    ap.add_argument("-shared", "--shared-chrome", action="store_true",
+                    help="draw axes and labels once and share them between charts")
+    ap.add_argument("-mxb", "--max-bars",
+                    metavar="N", type=int, help="merge runs of bars so each chart has at most N")
+    ap.add_argument("-br", "--bar-reducer", choices=REDUCERS, default="sum",
+                    help="with --max-bars, combine merged bars by this (default sum)")
+    ap.add_argument("-st", "--stats", action="store_true",
+                    help="write timings and counts of rendering to stderr")
     args = ap.parse_args()
+    if args.input and args.aggregate:
+        ap.error("--aggregate applies to stdin; give it to sm_convert.py for columnar data")
+    if args.max_bars is not None and args.max_bars < 1:
+        ap.error("--max-bars must be at least 1")
+    if args.precision is not None and args.precision < 0:
+        ap.error("--precision must not be negative")
 
     # print str(args)
 
+    stats = None
+    if args.stats:
+        stats = RenderStats()
+        t = stats.now()
+
     # Load maps of subjects/labels to color and title
     subject_map = load_map_file(args.subject_file)
     label_map = load_map_file(args.label_file)
 
-    # Read lines of standard in
-    # Capture subjects in order of arrival
-    subjects = []
-    subj_data = {}
-    lines = sys.stdin.readlines()
-    grand_total = 0
-    for line in lines:
-        if not line or len(line) == 0:
-            continue;
-        line = line.strip()
-        flds = line.split("\t")
-        if len(flds) != 3:
-            raise Exception("Line is not of form (subject, X, Y):\n" + line)
-        (s, x, y) = flds
-        if s not in subj_data:
-            subjects.append(s)
-            # Get chart color and title from subject map
-            ctitle = s
-            chart_opts = None
-            if s in subject_map:
-                if "label" in subject_map[s]:
-                    ctitle = subject_map[s]["label"]
-                if "color" in subject_map[s]:
-                    chart_opts = {"data_color": subject_map[s]["color"]}
-            # Init subject data
-            subj_data[s] = {"title": ctitle, "data": []}
-            # Get chart color from subject map
-            if chart_opts:
-                subj_data[s]["chart_opts"] = chart_opts
-
-        # Get X info
-        cinf = {"value": float(y)}
-        # Use label map
-        xlabel = x
-        if x in label_map:
-            if "label" in label_map[x]:
-                xlabel = label_map[x]["label"]
-            if "color" in label_map[x]:
-                cinf["color"] = label_map[x]["color"]
-        cinf["label"] = unescape_newlines(xlabel, args.newline)
-        
-        subj_data[s]["data"].append(cinf)
-        grand_total += float(y)
+    # Read lines of standard in as they arrive, into charts for subjects in order of arrival
+    if args.input:
+        (data, grand_total) = load_columnar(args.input, subject_map, label_map, args.newline)
+    else:
+        (data, grand_total) = read_subject_data(sys.stdin, subject_map, label_map, args.newline, args.aggregate)
 
-    # Compile chart data in order
-    data = []
-    for s in subjects:
-        data.append(subj_data[s])
+    if stats is not None:
+        stats.phase("read", t)
 
     # Get chart options
     opts = {}
@@ -108,53 +110,42 @@ def main(argv):
         "bar_spacing",
         "max_chart_aspect",
         "x_axis_title",
-        "y_axis_title"
+        "y_axis_title",
+        "coalesce_bars",
+        "precision"
         ]
     for k, v in adict.iteritems():
         # Ignore non-chart options
-        if k in chart_opts and v is not None:
+        if k in chart_opts and v is not None and v is not False:
             opts[k] = v
 
-    # Render
-    preserveAspectRatio = "xMinYMin"
-    code = render_small_multiples(data, args.width, args.height, preserveAspectRatio,
-                                  scale=args.scale, sort=args.sort, top=args.top, preserve_order=args.preserve_order,
-                                  totals=args.totals, chart_opts=opts)
-
     # Exit status is 0 if data was printed, 1 otherwise
-    if len(data) > 0:
-        gt = ""
-        if args.totals:
-            gt = " (" + num_disp(grand_total) + ")"
-        print h_h2(args.sm_title + gt, style="font-family: Arial")
-        print code
-        return 0
-    return 1
-
-# Un-escape newlines in titles
-def unescape_newlines(s, repl):
-    # First do the standard one
-    s = s.replace("\\n", "\n")
-    if repl is not None:
-        s = s.replace(repl, "\n")
-    return s
+    if len(data) == 0:
+        return 1
+    out = sys.stdout
+    if args.compress:
+        # Skirt Windows CRLF issues in compressed output
+        if os.name == "nt":
+            msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+        out = GzipSink(sys.stdout, level=args.compress_level, flush_bytes=args.flush_bytes)
+    gt = ""
+    if args.totals:
+        gt = " (" + num_disp(grand_total) + ")"
+    out.write(h_h2(args.sm_title + gt, style="font-family: Arial") + "\n")
 
-# Load map file
-def load_map_file(fn):
-    if not fn:
-        return {}
-    result = {}
-    lines = ()
-    with open(fn) as f:
-        lines = f.readlines()
-    for line in lines:
-        line = line.strip()
-        flds = line.split("\t")
-        if len(flds) >= 2:
-            result[flds[0]] = {"color": flds[1]}
-            if len(flds) >= 3:
-                result[flds[0]]["label"] = flds[2]
-    return result
+    # Render, streaming charts to output as they are produced
+    preserveAspectRatio = "xMinYMin"
+    render_small_multiples(data, args.width, args.height, preserveAspectRatio,
+                           scale=args.scale, sort=args.sort, top=args.top, preserve_order=args.preserve_order,
+                           totals=args.totals, chart_opts=opts, out=out, workers=args.workers,
+                           shared_chrome=args.shared_chrome, bar_classes=args.bar_classes, max_bars=args.max_bars,
+                           bar_reducer=args.bar_reducer, stats=stats)
+    out.write("\n")
+    if args.compress:
+        out.close()
+    if stats is not None:
+        stats.report(sys.stderr)
+    return 0
 
 # Do it
 sys.exit(main(sys.argv))
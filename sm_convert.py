@@ -0,0 +1,26 @@
+#!/usr/bin/python
+# Copyright 2014-2016 John K. Hinsdale
+
+from sm_input import AGGREGATES
+from smcol import convert_tsv
+import sys
+import argparse
+
+# Convert tuples (subject, X, Y) from stdin to a columnar data file for sm_chart.py
+def main(argv):
+
+    # Parse args
+    ap = argparse.ArgumentParser(description='Convert stdin data of form (subject, dimension, N) to a columnar data file for sm_chart.py -i.')
+    ap.add_argument("output",
+                    metavar="fn", help="write columnar data to fn")
+    ap.add_argument("-a", "--aggregate", choices=AGGREGATES,
+                    help="fold rows with the same subject and X value into their sum, count, mean or max")
+    args = ap.parse_args()
+
+    with open(args.output, "wb") as out:
+        convert_tsv(sys.stdin, out, aggregate=args.aggregate)
+    return 0
+
+# Do it
+sys.exit(main(sys.argv))
+sys.exit(2)
@@ -0,0 +1,146 @@
+#
+# sm_input.py -- Read small multiple data of form (subject, X, Y)
+#
+# Copyright 2014-2016 John K. Hinsdale
+
+from array import array
+from chart_data import ChartData
+
+# Ways to fold rows for the same subject and X label into one value
+AGGREGATES = ("sum", "count", "mean", "max")
+
+# Read tab-delimited lines of (subject, X, Y) from file f, as they arrive, into
+# chart info for render_small_multiples, one chart per subject in order of arrival.
+# Subjects and X values are mapped to color and title/label with subject_map and
+# label_map (None to keep X values as they are).  Each chart holds one data point per distinct X label.  If a label
+# repeats, rows are folded as they arrive by aggregate, one of AGGREGATES, with
+# missing Y values skipped; "count" ignores Y.  With no aggregate, the last value
+# is shown and chart totals count every row.
+# Returns (chart infos, grand total)
+def read_subject_data(f, subject_map, label_map, newline=None, aggregate=None):
+    if aggregate is not None and aggregate not in AGGREGATES:
+        raise ValueError("Unknown aggregate: " + str(aggregate))
+    subjects = []
+    subj_data = {}
+    labels = {}
+    grand_total = 0
+    counts = {}     # Rows per data point of subject, for "mean"
+
+    # Lines are read through the file's own buffering, not all at once
+    for line in f:
+        if not line or len(line) == 0:
+            continue;
+        line = line.strip()
+        flds = line.split("\t")
+        if len(flds) != 3:
+            raise Exception("Line is not of form (subject, X, Y):\n" + line)
+        (s, x, y) = flds
+
+        cinf = subj_data.get(s)
+        if cinf is None:
+            cinf = subj_data[s] = subject_info(s, subject_map)
+            subjects.append(cinf)
+
+        # Get X label and color, mapped once per distinct X
+        xinf = labels.get(x)
+        if xinf is None:
+            xinf = labels[x] = label_info(x, label_map, newline)
+        (xlabel, xcolor) = xinf
+
+        # Set data point for label, or fold row into it
+        if aggregate == "count":
+            v = 1.0
+        else:
+            v = float(y)
+            if v != v and aggregate is not None:
+                continue
+        cdata = cinf["data"]
+        i = cdata.label_id(xlabel)
+        c = -1 if xcolor is None else cdata.color_id(xcolor)
+        values = cdata.values
+        if i == len(values):
+            cdata.label_ids.append(i)
+            values.append(v)
+            cdata.color_ids.append(c)
+            if aggregate == "mean":
+                counts.setdefault(s, array('i')).append(1)
+        else:
+            cdata.color_ids[i] = c
+            if aggregate is None:
+                values[i] = v
+            elif aggregate == "max":
+                if v > values[i]:
+                    values[i] = v
+            else:
+                values[i] += v
+                if aggregate == "mean":
+                    counts[s][i] += 1
+        if aggregate is None:
+            if v == v:
+                cinf["total"] += v
+            grand_total += v
+
+    # Totals of folded data are of the values shown
+    if aggregate is not None:
+        for s, n in counts.iteritems():
+            values = subj_data[s]["data"].values
+            for i in range(0, len(n)):
+                values[i] /= n[i]
+        for cinf in subjects:
+            cinf["total"] = cinf["data"].total()
+            grand_total += cinf["total"]
+
+    return (subjects, grand_total)
+
+# Chart info for new subject, with chart color and title from subject map
+def subject_info(s, subject_map):
+    ctitle = s
+    chart_opts = None
+    if s in subject_map:
+        if "label" in subject_map[s]:
+            ctitle = subject_map[s]["label"]
+        if "color" in subject_map[s]:
+            chart_opts = {"data_color": subject_map[s]["color"]}
+    cinf = {"title": ctitle, "data": ChartData(), "total": 0}
+    if chart_opts:
+        cinf["chart_opts"] = chart_opts
+    return cinf
+
+# Get (label, color) for X value, using label map.  With no label map, the label
+# is the X value as is
+def label_info(x, label_map, newline):
+    if label_map is None:
+        return (x, None)
+    xlabel = x
+    xcolor = None
+    if x in label_map:
+        if "label" in label_map[x]:
+            xlabel = label_map[x]["label"]
+        if "color" in label_map[x]:
+            xcolor = label_map[x]["color"]
+    return (unescape_newlines(xlabel, newline), xcolor)
+
+# Un-escape newlines in titles
+def unescape_newlines(s, repl):
+    # First do the standard one
+    s = s.replace("\\n", "\n")
+    if repl is not None:
+        s = s.replace(repl, "\n")
+    return s
+
+# Load map file
+def load_map_file(fn):
+    if not fn:
+        return {}
+    result = {}
+    lines = ()
+    with open(fn) as f:
+        lines = f.readlines()
+    for line in lines:
+        line = line.strip()
+        flds = line.split("\t")
+        if len(flds) >= 2:
+            result[flds[0]] = {"color": flds[1]}
+            if len(flds) >= 3:
+                result[flds[0]]["label"] = flds[2]
+    return result
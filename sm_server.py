@@ -0,0 +1,297 @@
+#!/usr/bin/python
+# Copyright 2014-2016 John K. Hinsdale
+
+from small_multi import iter_small_multiples, num_disp
+from sm_input import read_subject_data, load_map_file, AGGREGATES
+from smcol import load_columnar, MAGIC
+from chart_data import REDUCERS
+from svgtag import ChunkedSink
+from html import h_html, h_head, h_title, h_body, h_h2, h_pre
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from collections import OrderedDict
+from cStringIO import StringIO
+import sys
+import os
+import argparse
+import hashlib
+import threading
+import urlparse
+import cgi
+
+# Serve pages of small multiple charts over HTTP, rendered from data of form
+# (subject, X, Y) that is POSTed to /render, or read from a file in the data
+# directory with GET /render?file=name.  Pages are cached by data and options.
+# Pages not cached are streamed to HTTP/1.1 clients a chart at a time, in chunked
+# transfer encoding
+def main(argv):
+
+    # Parse args
+    ap = argparse.ArgumentParser(description='Serve small-multiple charts over HTTP.')
+    ap.add_argument("-p", "--port", metavar="N", type=int, default=8000, help="listen on port N (default 8000)")
+    ap.add_argument("-b", "--bind", metavar="addr", default="127.0.0.1", help="listen on address addr (default 127.0.0.1)")
+    ap.add_argument("-d", "--data-dir", metavar="dir", help="serve data files, TSV or made by sm_convert.py, from dir")
+    ap.add_argument("-sub", "--subject-file",
+                    metavar="fn", help="file mapping subject to color [, title]")
+    ap.add_argument("-lab", "--label-file",
+                    metavar="fn", help="file mapping X value to color [, label]")
+    ap.add_argument("-cm", "--cache-memory", metavar="MB", type=float, default=64,
+                    help="cache up to MB megabytes of rendered pages (default 64)")
+    ap.add_argument("-mb", "--max-body", metavar="MB", type=float, default=64,
+                    help="accept POSTed data of up to MB megabytes (default 64)")
+    args = ap.parse_args()
+
+    server = ChartServer((args.bind, args.port), ChartRequestHandler)
+    server.data_dir = args.data_dir
+    server.subject_map = load_map_file(args.subject_file)
+    server.label_map = load_map_file(args.label_file)
+    server.cache = PageCache(int(args.cache_memory * 1024 * 1024))
+    server.max_body = int(args.max_body * 1024 * 1024)
+    sys.stderr.write("Serving charts on http://%s:%d/render\n" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+class ChartServer(ThreadingMixIn, HTTPServer):
+    """Chart server, handling each request in a thread"""
+    daemon_threads = True
+
+class ChartRequestHandler(BaseHTTPRequestHandler):
+    """Chart request handler"""
+    protocol_version = "HTTP/1.1"
+
+    # Render data from file in data directory
+    def do_GET(self):
+        (path, query) = self.parse_path()
+        if path != "/render":
+            return self.send_error(404)
+        fn = self.data_file(query.get("file"))
+        if fn is None:
+            return self.send_error(404, "No such data file")
+
+        # Files are keyed by name, size and time rather than read to digest them
+        st = os.stat(fn)
+        digest = hashlib.sha1("%s\0%d\0%r" % (fn, st.st_size, st.st_mtime)).hexdigest()
+        self.respond(digest, query, lambda: open(fn, "rb"), fn)
+
+    # Render POSTed data
+    def do_POST(self):
+        (path, query) = self.parse_path()
+        if path != "/render":
+            return self.send_error(404)
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self.send_bad_request("Bad Content-Length")
+        if length > self.server.max_body:
+            return self.send_error(413)
+        body = self.rfile.read(length)
+        self.respond(hashlib.sha1(body).hexdigest(), query, lambda: StringIO(body), None)
+
+    # Send page for data, rendering it unless cached.  open_data opens the data;
+    # fn is its file name, if columnar data is to be loaded from it
+    def respond(self, digest, query, open_data, fn):
+        try:
+            opts = page_options(query)
+        except ValueError, e:
+            return self.send_bad_request(str(e))
+        key = digest + "\0" + repr(sorted(opts.items()))
+        page = self.server.cache.get(key)
+        if page is not None:
+            return self.send_page(page, "hit")
+        try:
+            (data, grand_total) = load_page_data(open_data, fn, opts, self.server.subject_map, self.server.label_map)
+        except Exception, e:
+            return self.send_bad_request(str(e))
+        parts = iter_page(data, grand_total, opts)
+        try:
+            first = next(parts)
+            if self.request_version != "HTTP/1.1":
+                page = first + "".join(parts)
+        except Exception, e:
+            return self.send_bad_request(str(e))
+        if self.request_version != "HTTP/1.1":
+            self.server.cache.put(key, page)
+            return self.send_page(page, "miss")
+
+        # Stream page, caching it once it is all rendered.  Data is checked and charts
+        # laid out before the headers are sent, so bad data gets a 400; if a chart
+        # still fails after that, the connection is just dropped
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Cache", "miss")
+        self.end_headers()
+        out = ChunkedSink(self.wfile)
+        out.write(first)
+        sent = [first]
+        try:
+            for s in parts:
+                out.write(s)
+                sent.append(s)
+        except Exception, e:
+            self.log_error("Rendering failed: %r", str(e))
+            self.close_connection = 1
+            return
+        self.server.cache.put(key, "".join(sent))
+        out.close()
+
+    # Send 400 response.  Detail, which may quote the request or its data, goes
+    # escaped in the body only, never in the status line or headers
+    def send_bad_request(self, detail):
+        self.log_error("Bad request: %r", detail)
+        page = h_html(h_head(h_title("Bad request")), h_body(h_h2("Bad request"), h_pre(cgi.escape(detail))))
+        self.send_response(400)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(page)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(page)
+
+    # Send whole page
+    def send_page(self, page, cache_status):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(page)))
+        self.send_header("X-Cache", cache_status)
+        self.end_headers()
+        self.wfile.write(page)
+
+    # Get (path, query parameters) of request, taking the last of repeated parameters
+    def parse_path(self):
+        parts = urlparse.urlparse(self.path)
+        query = dict([(k, v[-1]) for (k, v) in urlparse.parse_qs(parts.query).iteritems()])
+        return (parts.path, query)
+
+    # Path of data file name in data directory, None if there is no such file
+    def data_file(self, name):
+        data_dir = self.server.data_dir
+        if not data_dir or not name:
+            return None
+        fn = os.path.realpath(os.path.join(data_dir, name))
+        if not fn.startswith(os.path.realpath(data_dir) + os.sep) or not os.path.isfile(fn):
+            return None
+        return fn
+
+# Page options taken from query parameters, by type
+_text_opts = ["title", "x_axis_title", "y_axis_title", "aggregate", "newline", "bar_reducer"]
+_float_opts = ["width", "height", "scale", "preferred_bar_width", "bar_spacing", "max_chart_aspect"]
+_int_opts = ["top", "precision", "max_bars"]
+_flag_opts = ["totals", "sort", "preserve_order", "coalesce_bars", "bar_classes", "shared_chrome"]
+
+# Chart options, as in sm_chart.py
+_chart_opts = ["preferred_bar_width", "bar_spacing", "max_chart_aspect", "x_axis_title", "y_axis_title",
+               "coalesce_bars", "precision"]
+
+# Get page options from query parameters, raising ValueError if one is bad
+def page_options(query):
+    opts = {}
+    for k in _text_opts:
+        if k in query:
+            opts[k] = query[k]
+    for (names, conv) in [(_float_opts, float), (_int_opts, int)]:
+        for k in names:
+            if k in query:
+                try:
+                    opts[k] = conv(query[k])
+                except ValueError:
+                    raise ValueError("Bad value for " + k + ": " + query[k])
+    for k in _flag_opts:
+        if query.get(k, "0") not in ("", "0", "false"):
+            opts[k] = True
+    if opts.get("aggregate") not in (None,) + AGGREGATES:
+        raise ValueError("Unknown aggregate: " + opts["aggregate"])
+    if opts.get("bar_reducer") not in (None,) + REDUCERS:
+        raise ValueError("Unknown bar reducer: " + opts["bar_reducer"])
+    if opts.get("max_bars", 1) < 1:
+        raise ValueError("Bad value for max_bars: " + query["max_bars"])
+    if opts.get("precision", 0) < 0:
+        raise ValueError("Bad value for precision: " + query["precision"])
+    return opts
+
+# Load data, opened by open_data, returning (chart infos, grand total).  Raises an
+# exception if there is nothing to chart, so that is reported before rendering
+def load_page_data(open_data, fn, opts, subject_map, label_map):
+    f = open_data()
+    try:
+        columnar = f.read(len(MAGIC)) == MAGIC
+        f.seek(0)
+        if columnar:
+            if fn is None:
+                raise Exception("Columnar data must be in a data file")
+            (data, grand_total) = load_columnar(fn, subject_map, label_map, opts.get("newline"))
+        else:
+            (data, grand_total) = read_subject_data(f, subject_map, label_map, opts.get("newline"), opts.get("aggregate"))
+    finally:
+        f.close()
+    if len(data) == 0:
+        raise Exception("No data")
+    for cinf in data:
+        if cinf["data"].max_value() is not None:
+            break
+    else:
+        raise Exception("No data values, all are missing")
+    return (data, grand_total)
+
+# Render page for data with page options opts, yielding the page in parts: its
+# head, title and chart style, the charts one at a time, and its end.  Charts are
+# laid out before the first part is yielded, so most failures come from that
+def iter_page(data, grand_total, opts):
+    # Titles from the query are escaped, as they go into the page as is
+    title = cgi.escape(opts.get("title", ""))
+    if opts.get("totals"):
+        title += " (" + num_disp(grand_total) + ")"
+    chart_opts = dict([(k, opts[k]) for k in _chart_opts if k in opts])
+    for k in ("x_axis_title", "y_axis_title"):
+        if k in chart_opts:
+            chart_opts[k] = cgi.escape(chart_opts[k])
+    charts = iter_small_multiples(data, opts.get("width"), opts.get("height"), "xMinYMin",
+                                  scale=opts.get("scale"), sort=opts.get("sort", False), top=opts.get("top"),
+                                  preserve_order=opts.get("preserve_order", False), totals=opts.get("totals", False),
+                                  chart_opts=chart_opts,
+                                  shared_chrome=opts.get("shared_chrome", False), bar_classes=opts.get("bar_classes", False),
+                                  max_bars=opts.get("max_bars"), bar_reducer=opts.get("bar_reducer", "sum"))
+    style = next(charts, "")
+    yield "<html>" + h_head(h_title(title)) + "<body>" + h_h2(title, style="font-family: Arial") + "\n" + style
+    for s in charts:
+        yield s
+    yield "\n</body></html>"
+
+class PageCache:
+    """Pages by key, holding at most max_bytes of them, dropping least recently used"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.pages = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    # Get page for key, None if not cached
+    def get(self, key):
+        with self.lock:
+            page = self.pages.pop(key, None)
+            if page is not None:
+                self.pages[key] = page
+            return page
+
+    # Cache page for key, unless it is bigger than the whole cache
+    def put(self, key, page):
+        if len(page) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.pages.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self.pages[key] = page
+            self.bytes += len(page)
+            while self.bytes > self.max_bytes:
+                (k, dropped) = self.pages.popitem(last=False)
+                self.bytes -= len(dropped)
+
+# Do it
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -4,116 +4,397 @@
 # Copyright 2014-2016 John K. Hinsdale
 
 from toposort import toposort
-from svgtag import st_style, st_svg, st_text, st_rect, st_line, st_coords, pp
+from array import array
+import multiprocessing, hashlib, heapq
+from svgtag import st_style, st_svg, st_text, st_rect, st_line, st_coords, pp, StringSink, svg_writer
 from chart import Chart, string_height
+from chart_data import ChartData, chart_data, rebucket, bucket_labels, NAN
+from smcol import load_columnar
 
-# Given data, process and render small multiple charts
-def render_small_multiples(data, width, height, preserveAspectRatio, scale=None, totals=False, sort=False, top=None, preserve_order=False, chart_opts={}):
+# Given data, process and render small multiple charts.  If out (a file-like
+# sink or SvgWriter) is given the charts are written to it one at a time as they
+# are rendered and None is returned, otherwise the result is returned as a string.
+# Each chart's "data" may be ChartData or a list of dicts, which is converted once.
+# A chart's "total" is the total of its data unless given.  Data may also be the
+# name of a columnar data file (see smcol), with a chart per subject.
+# With workers > 1, charts are rendered in that many processes; output order is the same.
+# With shared_chrome, axes, labels and border are emitted once in <defs> and each
+# chart refers to them with <use>.  With bar_classes, bars are styled by CSS classes,
+# one per distinct color across all charts, instead of inline attributes.
+# With max_bars, runs of bars are merged so each chart has at most that many,
+# their values combined by bar_reducer (see chart_data.rebucket()).
+# If stats (a RenderStats) is given, time spent in each phase, charts and output are
+# recorded in it; time within charts is only recorded when rendering without workers
+def render_small_multiples(data, width, height, preserveAspectRatio, scale=None, totals=False, sort=False, top=None, preserve_order=False, chart_opts={}, out=None,
+                           workers=None, shared_chrome=False, bar_classes=False, max_bars=None, bar_reducer="sum", stats=None):
+    sink = None
+    if out is None:
+        sink = out = StringSink()
+    for done in _render_charts(out, data, width, height, preserveAspectRatio, scale=scale, totals=totals, sort=sort, top=top,
+                               preserve_order=preserve_order, chart_opts=chart_opts, workers=workers,
+                               shared_chrome=shared_chrome, bar_classes=bar_classes, max_bars=max_bars,
+                               bar_reducer=bar_reducer, stats=stats):
+        pass
+    if sink is not None:
+        return sink.getvalue()
+    return None
+
+# Given data, render small multiple charts lazily, yielding the style block, then
+# each chart's SVG (preceded by its chrome, if shared and not yet yielded) as soon
+# as it is rendered.  Arguments are as for render_small_multiples(), less out
+def iter_small_multiples(data, width, height, preserveAspectRatio, **kwargs):
+    sink = StringSink()
+    for done in _render_charts(sink, data, width, height, preserveAspectRatio, **kwargs):
+        s = sink.getvalue()
+        del sink.parts[:]
+        yield s
+
+# Render small multiple charts as render_small_multiples() does, writing them to
+# out element by element.  A generator, stopping after the style block and after
+# each chart is written, so callers can take what has been written so far
+def _render_charts(out, data, width, height, preserveAspectRatio, scale=None, totals=False, sort=False, top=None, preserve_order=False,
+                   chart_opts={}, workers=None, shared_chrome=False, bar_classes=False, max_bars=None, bar_reducer="sum",
+                   stats=None):
 
     # print data
+    if stats is not None:
+        t = stats.now()
 
-    # Scan data and get overall max, totals, and lists of labels for merging, max title height
-    label_seqs = []
+    # Scan data and get overall max, totals, max title height
     overall_max = None
     max_chart_title_lines = None
+    if isinstance(data, basestring):
+        data = load_columnar(data, {}, {})[0]
     for cinf in data:
-        cdata = cinf["data"]
-        label_seqs.append([item["label"] for item in cdata])
-        cinf["total"] = 0
-        for item in cdata:
-            if item["value"] is not None:
-                if overall_max is None or item["value"] > overall_max:
-                    overall_max = item["value"]
-                cinf["total"] += item["value"]
+        cdata = cinf["data"] = chart_data(cinf["data"])
+        if "total" not in cinf:
+            cinf["total"] = cdata.total()
+        cmax = cdata.max_value()
+        if cmax is not None and (overall_max is None or cmax > overall_max):
+            overall_max = cmax
 
         h = string_height(cinf["title"])
         if max_chart_title_lines is None or h > max_chart_title_lines:
             max_chart_title_lines = h
 
+    if stats is not None:
+        t = stats.phase("scan", t)
+
     # print overall_max
-    # print label_seqs
-    all_labels = total_order(label_seqs, preserve_order=preserve_order)
+    (all_labels, slot_maps) = merge_labels([cinf["data"] for cinf in data], preserve_order=preserve_order)
     # print all_labels
-    
-    # Rebuild input sequences of data
-    for i in range(0, len(data)):
-        cdata_labels = {}
-        cdata = data[i]["data"]
-        for item in cdata:
-            cdata_labels[item["label"]] = item
-        new_cdata = []
-        for label in all_labels:
-            if label in cdata_labels:
-                new_cdata.append(cdata_labels[label])
-            else:
-                new_cdata.append({"label": label, "value": None})
-        data[i]["data"] = new_cdata
-
-    # Sort charts reverse by total, then title
-    def sort_by_top_total(a, b):
-        res = cmp(b["total"], a["total"])
-        if res == 0:
-            return cmp(a["title"], b["title"])
-        return res
-    if sort or top:
-        data.sort(cmp=sort_by_top_total)
-
-    # If doing "top", clip off top elements and append "others" chart data
-    # Only aggregate smaller data if two or more would be consolidated
+    if stats is not None:
+        t = stats.phase("merge_labels", t)
+
+    # Pick charts to show, reverse by total, then title.  If doing "top", only the
+    # top charts are picked, and the rest are summed into an "others" chart without
+    # being realigned.  Only aggregate smaller data if two or more would be consolidated
+    order_key = lambda i: (-data[i]["total"], data[i]["title"])
+    indexes = range(0, len(data))
+    agg_cinf = None
     if top is not None and top < len(data) - 1:
-        # Clip off top charts
-        to_agg = data[top:]
-        data = data[0:top]
-        agg_cinf = {"title": "+ " + str(len(to_agg)) + " others", "data": []}
-        agg_data = agg_cinf["data"]
-        agg_total = 0
-        for label in all_labels:
-            agg_data.append({"label":label, "value": None})
-        for cinf in to_agg:
-            i = 0
-            for item in cinf["data"]:
-                if item["value"] is not None:
-                    if agg_data[i]["value"] is None:
-                        agg_data[i]["value"] = 0
-                    agg_data[i]["value"] += item["value"]
-                    agg_total += item["value"]
-                i += 1
-        agg_cinf["total"] = agg_total
-        data.append(agg_cinf)
+        shown = heapq.nsmallest(top, indexes, key=order_key)
+        is_shown = set(shown)
+        to_agg = [i for i in indexes if i not in is_shown]
+        agg_cinf = _others_chart(data, to_agg, slot_maps, all_labels)
+    elif sort or top:
+        shown = sorted(indexes, key=order_key)
+    else:
+        shown = indexes
+    if stats is not None:
+        t = stats.phase("select", t)
 
-    # Create charts
-    first = True
-    result = ""
-    for cinfo in data:
-        chart = Chart()
-
-        # Set chart title and height in lines
-        chart.chart_title = cinfo["title"]
-        if totals and cinfo["total"]:
-            chart.chart_title += " (" + num_disp(cinfo["total"]) + ")"
-        chart.y_chart_title_lines = max_chart_title_lines
-
-        # Set chart data
-        chart.data = cinfo["data"]
-
-        # Set chart options from global input, plus per-data chart options (e.g., chart data color) which override
-        opts = cinfo.get("chart_opts", {})
-        opts = dict(chart_opts.items() + opts.items())
-        for k, v in opts.iteritems():
-            setattr(chart, k, opts[k])
-
-        # print chart.data
-        chart.data_max = overall_max
-        if first:
-            result += chart.render_style()
-            first = False
-        result += chart.render_svg(width=width, height=height, scale=scale, preserveAspectRatio=preserveAspectRatio)
+    # Rebuild input sequences of charts shown as sparse data over the slots for all
+    # labels.  Charts share the label table; only points present are kept, so
+    # missing bars cost nothing
+    charts = []
+    for i in shown:
+        cdata = data[i]["data"]
+        at_slot = _slot_points(cdata, slot_maps[i])
+        present = sorted(at_slot)
+        cvalues = cdata.values
+        ccolor_ids = cdata.color_ids
+        data[i]["data"] = ChartData(labels=all_labels, label_ids=array('i', present),
+                                    values=array('d', [cvalues[at_slot[s]] for s in present]),
+                                    colors=cdata.colors,
+                                    color_ids=array('i', [ccolor_ids[at_slot[s]] for s in present]),
+                                    sparse=True)
+        charts.append(data[i])
+    if agg_cinf is not None:
+        charts.append(agg_cinf)
+    data = charts
+    if stats is not None:
+        t = stats.phase("realign", t)
 
-    return result
+    # Rebucket charts shown to at most max_bars bars.  They share the X axis, so
+    # bucket labels are made once.  Merged bars can exceed the largest input value,
+    # so the overall max is taken again, over every bar drawn.  Bucketed data goes
+    # in copies of the chart infos, so the caller's data can be rendered again
+    if max_bars is not None and len(all_labels) > max_bars:
+        labels = bucket_labels(all_labels, max_bars)
+        overall_max = None
+        charts = []
+        for cinf in data:
+            cinf = dict(cinf)
+            cdata = cinf["data"] = rebucket(cinf["data"], max_bars, bar_reducer, labels)
+            cmax = cdata.max_value()
+            if cmax is not None and (overall_max is None or cmax > overall_max):
+                overall_max = cmax
+            charts.append(cinf)
+        data = charts
+        if stats is not None:
+            t = stats.phase("rebucket", t)
+
+    # Layout inputs shared by all charts
+    layout = {
+        "width": width,
+        "height": height,
+        "preserveAspectRatio": preserveAspectRatio,
+        "scale": scale,
+        "totals": totals,
+        "chart_opts": chart_opts,
+        "overall_max": overall_max,
+        "max_chart_title_lines": max_chart_title_lines,
+        "shared_chrome": shared_chrome,
+        "bar_classes": None,
+        }
+
+    # Collect distinct bar styles across all charts, for one CSS class each in the shared style
+    if bar_classes:
+        classes = {}
+        for cinfo in data:
+            for style in _make_chart(cinfo, layout).bar_styles():
+                if style not in classes:
+                    classes[style] = "bar" + str(len(classes))
+        layout["bar_classes"] = classes
+        if stats is not None:
+            t = stats.phase("bar_classes", t)
+
+    # Create charts
+    if stats is not None:
+        stats.count("charts", len(data))
+        out = stats.sink(out)
+    w = svg_writer(out)
+    chrome_ids = {}
+    if workers is not None and workers > 1 and len(data) > 1:
+        # Style comes from first chart.  Layout goes to each worker once, when it starts
+        w.write(_make_chart(data[0], layout).render_style())
+        yield True
+        pool = multiprocessing.Pool(workers, _init_worker, (layout,))
+        try:
+            chunksize = max(1, len(data) // (workers * 4))
+            if stats is not None:
+                t = stats.now()
+            for (chrome_id, chrome, svg) in pool.imap(_render_chart, data, chunksize):
+                if chrome_id is not None and chrome_id not in chrome_ids:
+                    chrome_ids[chrome_id] = True
+                    _write_chrome(w, chrome_id, chrome)
+                w.write(svg)
+                if stats is not None:
+                    stats.phase("render", t)
+                yield True
+                if stats is not None:
+                    t = stats.now()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        first = True
+        for cinfo in data:
+            if stats is not None:
+                t = stats.now()
+            chart = _make_chart(cinfo, layout)
+            if first:
+                w.write(chart.render_style())
+                if stats is not None:
+                    stats.phase("render", t)
+                yield True
+                if stats is not None:
+                    t = stats.now()
+                first = False
+            chrome_id = None
+            if shared_chrome:
+                (chrome_id, chrome) = _chart_chrome(chart)
+                if chrome_id not in chrome_ids:
+                    chrome_ids[chrome_id] = True
+                    _write_chrome(w, chrome_id, chrome)
+            _render_chart_svg(chart, layout, w, chrome_id, stats)
+            if stats is not None:
+                stats.phase("render", t)
+            yield True
 
     # o = total_order(seqs)
     # print o
 
+# Create chart for chart info
+def _make_chart(cinfo, layout):
+    chart = Chart()
+
+    # Set chart title and height in lines
+    chart.chart_title = cinfo["title"]
+    if layout["totals"] and cinfo["total"]:
+        chart.chart_title += " (" + num_disp(cinfo["total"]) + ")"
+    chart.y_chart_title_lines = layout["max_chart_title_lines"]
+    if layout["bar_classes"] is not None:
+        chart.bar_classes = layout["bar_classes"]
+
+    # Set chart data
+    chart.data = cinfo["data"]
+
+    # Set chart options from global input, plus per-data chart options (e.g., chart data color) which override
+    opts = cinfo.get("chart_opts", {})
+    opts = dict(layout["chart_opts"].items() + opts.items())
+    for k, v in opts.iteritems():
+        setattr(chart, k, opts[k])
+
+    # print chart.data
+    chart.data_max = layout["overall_max"]
+    return chart
+
+# Render chart SVG to out
+def _render_chart_svg(chart, layout, out, chrome_id=None, stats=None):
+    chart.render_svg(width=layout["width"], height=layout["height"], scale=layout["scale"],
+                     preserveAspectRatio=layout["preserveAspectRatio"], out=out, chrome_id=chrome_id, stats=stats)
+
+# Get chart chrome and an id for it.  The id depends only on the content, so charts
+# with identical chrome share it however they were rendered
+def _chart_chrome(chart):
+    chrome = chart.render_chrome()
+    return ("smc" + hashlib.sha1(chrome).hexdigest()[:12], chrome)
+
+# Write chrome into a hidden SVG, as a group that charts can <use>
+def _write_chrome(w, chrome_id, chrome):
+    w.start("svg", width=0, height=0, style="position: absolute")
+    w.start("defs")
+    w.start("g", id=chrome_id)
+    w.write(chrome)
+    w.end()
+    w.end()
+    w.end()
+
+# Map slots of chart's data points to the index of the point in that slot.  The last
+# point for a label wins, and missing points are dropped
+def _slot_points(cdata, slots):
+    label_ids = cdata.label_ids
+    values = cdata.values
+    result = {}
+    for j in range(0, len(values)):
+        if values[j] == values[j]:
+            result[slots[label_ids[j]]] = j
+        else:
+            result.pop(slots[label_ids[j]], None)
+    return result
+
+# Create "others" chart info, summing data of charts at given indexes by slot in one pass
+def _others_chart(data, indexes, slot_maps, all_labels):
+    nslots = len(all_labels)
+    agg_values = array('d', [NAN]) * nslots
+    agg_total = 0
+    last_chart = array('i', [-1]) * nslots
+    for i in indexes:
+        cdata = data[i]["data"]
+        slots = slot_maps[i]
+        label_ids = cdata.label_ids
+        values = cdata.values
+
+        # Sum points as they are, unless a label repeats and only the last counts
+        points = range(0, len(values))
+        for j in points:
+            slot = slots[label_ids[j]]
+            if last_chart[slot] == i:
+                points = _slot_points(cdata, slots).values()
+                break
+            last_chart[slot] = i
+        for j in points:
+            v = values[j]
+            if v == v:
+                slot = slots[label_ids[j]]
+                if agg_values[slot] != agg_values[slot]:
+                    agg_values[slot] = 0
+                agg_values[slot] += v
+                agg_total += v
+    agg_data = ChartData(labels=all_labels, label_ids=array('i', range(0, nslots)), values=agg_values,
+                         color_ids=array('i', [-1]) * nslots)
+    return {"title": "+ " + str(len(indexes)) + " others", "data": agg_data, "total": agg_total}
+
+# Layout for charts rendered in this worker process, and ids of chrome it has sent
+_worker_layout = None
+_worker_chrome_ids = {}
+
+# Start worker process
+def _init_worker(layout):
+    global _worker_layout
+    _worker_layout = layout
+
+# Render chart in worker process, returning (chrome id, chrome, SVG).  Chrome is
+# only sent back the first time this worker sees it; as a worker takes charts in
+# order, the parent will have had it from an earlier chart if it is not sent
+def _render_chart(cinfo):
+    chart = _make_chart(cinfo, _worker_layout)
+    chrome_id = chrome = None
+    if _worker_layout["shared_chrome"]:
+        (chrome_id, chrome) = _chart_chrome(chart)
+        if chrome_id in _worker_chrome_ids:
+            chrome = None
+        _worker_chrome_ids[chrome_id] = True
+    sink = StringSink()
+    _render_chart_svg(chart, _worker_layout, sink, chrome_id)
+    return (chrome_id, chrome, sink.getvalue())
+
+
+# Merge label orderings of charts' ChartData into one total ordering, as total_order()
+# does but in one pass over the data.  Labels are interned to integer ids once.
+# Returns (all labels in order, slot maps), where each chart's slot map is an array
+# taking its own label ids to positions in the total ordering
+def merge_labels(cdatas, preserve_order=False):
+    # Intern labels
+    ids = {}
+    labels = []
+    chart_gids = []
+    prev_labels = None
+    for cdata in cdatas:
+        # Charts may share a label table, which is interned once
+        if cdata.labels is prev_labels:
+            chart_gids.append(gids)
+            continue
+        prev_labels = cdata.labels
+        gids = array('i')
+        for label in cdata.labels:
+            gid = ids.get(label)
+            if gid is None:
+                gid = ids[label] = len(labels)
+                labels.append(label)
+            gids.append(gid)
+        chart_gids.append(gids)
+
+    if not preserve_order:
+        # Straight sort
+        order = sorted(range(0, len(labels)), key=labels.__getitem__)
+    else:
+        # Topo sort of graph of label ids, each label depending on those right before it
+        ordering = {}
+        for i in range(0, len(cdatas)):
+            gids = chart_gids[i]
+            prev = None
+            for j in cdatas[i].label_ids:
+                gid = gids[j]
+                if gid not in ordering:
+                    ordering[gid] = set()
+                if prev is not None:
+                    ordering[gid].add(prev)
+                prev = gid
+        order = []
+        for ties in toposort(ordering):
+            order.extend(sorted(ties, key=labels.__getitem__))
+
+    # Map each label id to its slot
+    slots = array('i', [0]) * len(labels)
+    for i in range(0, len(order)):
+        slots[order[i]] = i
+    slot_maps = []
+    for gids in chart_gids:
+        slot_maps.append(array('i', [slots[gid] for gid in gids]))
+    return ([labels[gid] for gid in order], slot_maps)
 
 # Merge partial orderings into a total ordering by constructing order graph and doing a topo sort
 # Alternatively, just do a straight sort
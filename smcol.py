@@ -0,0 +1,155 @@
+#
+# smcol.py -- Binary columnar small multiple data
+#
+# Copyright 2014-2016 John K. Hinsdale
+
+# Data of form (subject, X, Y) is stored with one data point per distinct
+# (subject, X), grouped by subject.  The file is read whole in one go, and charts
+# are loaded a column slice at a time with no per-row parsing.  All numbers are
+# little-endian; each section starts on an 8-byte boundary:
+#
+#   magic              "SMCOL\0\1\0"
+#   header             nsubjects, nlabels, npoints (uint32), unused (uint32),
+#                      grand total (float64)
+#   subject names      offsets (uint32 x nsubjects+1), then the bytes
+#   X values           offsets (uint32 x nlabels+1), then the bytes
+#   subject points     offset of each subject's first point (uint32 x nsubjects+1)
+#   subject totals     float64 x nsubjects
+#   label ids          index into X values (int32 x npoints)
+#   values             float64 x npoints
+#
+# Subject names and X values are stored as they came in; subject and label
+# maps are applied when the file is loaded, so many views can be rendered from it
+
+import struct, sys
+from array import array
+from chart_data import ChartData
+from sm_input import read_subject_data, subject_info, label_info
+
+MAGIC = "SMCOL\0\1\0"
+_header = struct.Struct("<IIIId")
+
+# Read tab-delimited lines of (subject, X, Y) from file f and write them to file
+# out in columnar form.  Duplicate (subject, X) rows are folded as by
+# read_subject_data() with aggregate
+def convert_tsv(f, out, aggregate=None):
+    (data, grand_total) = read_subject_data(f, {}, None, aggregate=aggregate)
+    write_columnar(out, data, grand_total)
+
+# Write chart infos, as read by read_subject_data() with no maps, to file out
+def write_columnar(out, data, grand_total):
+    # Intern X values across subjects
+    ids = {}
+    labels = []
+    starts = array('I', [0])
+    totals = array('d')
+    label_ids = array('i')
+    values = array('d')
+    for cinf in data:
+        cdata = cinf["data"]
+        gids = []
+        for label in cdata.labels:
+            gid = ids.get(label)
+            if gid is None:
+                gid = ids[label] = len(labels)
+                labels.append(label)
+            gids.append(gid)
+        label_ids.extend([gids[i] for i in cdata.label_ids])
+        values.extend(cdata.values)
+        starts.append(len(values))
+        totals.append(cinf["total"])
+
+    out.write(MAGIC)
+    out.write(_header.pack(len(data), len(labels), len(values), 0, grand_total))
+    _write_strings(out, [cinf["title"] for cinf in data])
+    _write_strings(out, labels)
+    for a in (starts, totals, label_ids, values):
+        _write_array(out, a)
+
+# Load columnar data file fn into chart info for render_small_multiples, one chart
+# per subject, mapping subjects and X values as read_subject_data() does.
+# Returns (chart infos, grand total)
+def load_columnar(fn, subject_map, label_map, newline=None):
+    with open(fn, "rb") as f:
+        m = f.read()
+    if m[0:len(MAGIC)] != MAGIC:
+        raise Exception("Not a columnar data file: " + fn)
+    pos = len(MAGIC)
+    (nsubjects, nlabels, npoints, unused, grand_total) = _header.unpack_from(m, pos)
+    pos += _header.size
+    (subjects, pos) = _read_strings(m, pos, nsubjects)
+    (xs, pos) = _read_strings(m, pos, nlabels)
+    (starts, pos) = _read_array(m, pos, 'I', nsubjects + 1)
+    (totals, pos) = _read_array(m, pos, 'd', nsubjects)
+    (label_ids, pos) = _read_array(m, pos, 'i', npoints)
+    (values, pos) = _read_array(m, pos, 'd', npoints)
+    del m
+
+    # Map X values once; charts share the label and color tables
+    labels = []
+    colors = []
+    color_index = {}
+    x_color_ids = array('i')
+    for x in xs:
+        (xlabel, xcolor) = label_info(x, label_map, newline)
+        labels.append(xlabel)
+        c = -1
+        if xcolor is not None:
+            c = color_index.get(xcolor)
+            if c is None:
+                c = color_index[xcolor] = len(colors)
+                colors.append(xcolor)
+        x_color_ids.append(c)
+
+    data = []
+    for i in range(0, nsubjects):
+        cinf = subject_info(subjects[i], subject_map)
+        ids = label_ids[starts[i]:starts[i+1]]
+        if colors:
+            color_ids = array('i', [x_color_ids[x] for x in ids])
+        else:
+            color_ids = array('i', [-1]) * len(ids)
+        cinf["data"] = ChartData(labels=labels, label_ids=ids, values=values[starts[i]:starts[i+1]],
+                                 colors=colors, color_ids=color_ids)
+        cinf["total"] = totals[i]
+        data.append(cinf)
+    return (data, grand_total)
+
+# Write strings as offsets, then their bytes
+def _write_strings(out, strs):
+    offsets = array('I', [0])
+    for s in strs:
+        offsets.append(offsets[-1] + len(s))
+    _write_array(out, offsets)
+    out.write("".join(strs))
+    _pad(out, offsets[-1])
+
+# Read n strings at pos, returning (strings, position after them)
+def _read_strings(m, pos, n):
+    (offsets, pos) = _read_array(m, pos, 'I', n + 1)
+    strs = [m[pos + offsets[i]:pos + offsets[i+1]] for i in range(0, n)]
+    return (strs, _aligned(pos + offsets[-1]))
+
+# Write array in little-endian byte order
+def _write_array(out, a):
+    if sys.byteorder != "little":
+        a = array(a.typecode, a)
+        a.byteswap()
+    out.write(a.tostring())
+    _pad(out, len(a) * a.itemsize)
+
+# Read n items of array type typecode at pos, returning (array, position after it)
+def _read_array(m, pos, typecode, n):
+    a = array(typecode)
+    end = pos + n * a.itemsize
+    a.fromstring(buffer(m, pos, end - pos))
+    if sys.byteorder != "little":
+        a.byteswap()
+    return (a, _aligned(end))
+
+# Pad section of nbytes out to 8-byte boundary
+def _pad(out, nbytes):
+    out.write("\0" * (_aligned(nbytes) - nbytes))
+
+def _aligned(n):
+    return (n + 7) & ~7
@@ -2,42 +2,288 @@
 # Copyright 2014-2016 John K. Hinsdale
 
 import pprint
+import zlib
 
 # Wrap args inside <TAG kw1=val1 kw2=val2>...</TAG> or <TAG kw1=val1 kw2=val2 />
 def svgtag(tag, closer, *args, **kwargs):
-    # Strip off leading "_" which may be used to avoid reserved word clashes
-    def strip_fix(att):
-        if att[0] == "_":
-            att = att[1:]
-        # Replace "_" with "-" so we can use in Python syntax
-        att = att.replace("_", "-")
-        return att
-    def kval(k):
-        result = " " + strip_fix(k)
-        if kwargs[k] is not None:
-            result += "=\"" + xstr(kwargs[k]) + "\""
-        return result;
-    # result = "<" + tag + scat(map(kval, kwargs.keys()))
-    result = "<" + tag + scat([kval(k) for k in kwargs.keys()])
+    result = "<" + tag + _attrs(kwargs)
     if closer:
         result += ">" + scat(args) + "</" + tag + ">"
     else:
         result += " />"
     return result + "\n"
 
+# Opening tag <TAG kw1=val1 kw2=val2> only, for content written separately
+def svgtag_open(tag, **kwargs):
+    return "<" + tag + _attrs(kwargs) + ">"
+
+# Closing tag </TAG> matching svgtag_open()
+def svgtag_close(tag):
+    return "</" + tag + ">\n"
+
+# Attributes string " kw1=val1 kw2=val2"
+def _attrs(kwargs):
+    result = ""
+    for k, v in kwargs.iteritems():
+        prefix = _attr_prefixes.get(k) or _attr_prefix(k)
+        if v is None:
+            result += prefix[:-2]
+        else:
+            result += prefix + str(v) + "\""
+    return result
+
+# Attribute name for keyword name
+def attr_name(k):
+    # Strip off leading "_" which may be used to avoid reserved word clashes
+    if k[0] == "_":
+        k = k[1:]
+    # Replace "_" with "-" so we can use in Python syntax
+    return k.replace("_", "-")
+
+# Cache of keyword name -> ' attr="' so names are only translated once
+_attr_prefixes = {}
+
+def _attr_prefix(k):
+    prefix = " " + attr_name(k) + "=\""
+    _attr_prefixes[k] = prefix
+    return prefix
+
+# Order in which svgtag() sees keyword names passed on through **kwargs, which
+# is what decides the order attributes are written in
+def _kwargs_order(**kwargs):
+    return tuple(kwargs)
+
+# Cache of compiled '<TAG kw1="{i}" kw2="{j}" ... />' formats, by tag and keyword
+# names in the order the caller's kwargs dict yields them
+_tag_formats = {}
+
+def _tag_format(tag, closer, kwargs):
+    keys = tuple(kwargs)
+    fmt = "<" + tag
+    for k in _kwargs_order(**kwargs):
+        fmt += _brace_escape(_attr_prefix(k)) + "{" + str(keys.index(k)) + "}\""
+    if closer:
+        fmt += ">"
+    else:
+        fmt += " />\n"
+    fmt = fmt.format
+    _tag_formats[(tag, keys)] = fmt
+    return fmt
+
+# Same as svgtag() but using a compiled format for the tag and attributes
+def _element(tag, closer, args, kwargs):
+    values = kwargs.values()
+    if None in values:
+        return svgtag(tag, closer, *args, **kwargs)
+    fmt = _tag_formats.get((tag, tuple(kwargs))) or _tag_format(tag, closer, kwargs)
+    result = fmt(*values)
+    if closer:
+        if len(args) == 1 and isinstance(args[0], str):
+            content = args[0]
+        else:
+            content = scat(args)
+        result += content + "</" + tag + ">\n"
+    return result
+
 def st_style(*args, **kwargs):		return svgtag("style", True, *args, **kwargs)
 def st_svg(*args, **kwargs):		return svgtag("svg", True, *args, **kwargs)
-def st_text(*args, **kwargs):		return svgtag("text", True, *args, **kwargs)
-def st_line(*args, **kwargs):		return svgtag("line", False, *args, **kwargs)
-def st_rect(*args, **kwargs):		return svgtag("rect", False, *args, **kwargs)
+def st_text(*args, **kwargs):		return _element("text", True, args, kwargs)
+def st_line(*args, **kwargs):		return _element("line", False, args, kwargs)
+def st_rect(*args, **kwargs):		return _element("rect", False, args, kwargs)
+def st_path(*args, **kwargs):		return _element("path", False, args, kwargs)
+def st_use(*args, **kwargs):		return _element("use", False, args, kwargs)
+
+# Precompiled element with a fixed set of attributes, for loops that emit many
+# elements of one shape.  names are keyword names as would be passed to svgtag(),
+# in the same order; fixed maps some of them to values that never change.  Returns
+# a function taking the values of the remaining names positionally, in order,
+# followed by the content if closer.  Values must not be None.  Output is identical
+# to the equivalent svgtag() call.
+_templates = {}
+
+def svg_template(tag, closer, names, fixed={}):
+    key = (tag, closer, tuple(names), tuple(sorted(fixed.items())))
+    if key in _templates:
+        return _templates[key]
+
+    # Lay attributes out in the order svgtag() would get them from kwargs
+    kwargs = {}
+    for name in names:
+        kwargs[name] = None
+    var = [name for name in names if name not in fixed]
+    fmt = "<" + tag
+    for name in _kwargs_order(**kwargs):
+        fmt += _brace_escape(_attr_prefix(name))
+        if name not in fixed:
+            fmt += "{" + str(var.index(name)) + "}\""
+        elif fixed[name] is not None:
+            fmt += _brace_escape(str(fixed[name])) + "\""
+        else:
+            fmt = fmt[:-2]
+    if closer:
+        fmt += ">{" + str(len(var)) + "}</" + tag + ">\n"
+    else:
+        fmt += " />\n"
+    _templates[key] = fmt.format
+    return fmt.format
+
+def _brace_escape(s):
+    return s.replace("{", "{{").replace("}", "}}")
+
+# Streaming writer: sends elements straight to a file-like sink (anything
+# with a write() method, e.g. sys.stdout, a socket file or a gzip stream)
+# instead of building the whole document up as one string
+class SvgWriter:
+    """SVG writer"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.open_tags = []
+
+    # Write elements or text; nested lists are flattened as in scat()
+    def write(self, *args):
+        if len(args) == 1 and isinstance(args[0], str):
+            self.sink.write(args[0])
+            return
+        for s in flatten(args):
+            if s is not None:
+                self.sink.write(str(s))
+
+    # Open a container element, e.g. <svg ...>
+    def start(self, tag, **kwargs):
+        self.sink.write(svgtag_open(tag, **kwargs))
+        self.open_tags.append(tag)
+
+    # Close the most recently opened container element
+    def end(self):
+        self.sink.write(svgtag_close(self.open_tags.pop()))
+
+    # Flush the sink, if it can be
+    def flush(self):
+        if hasattr(self.sink, "flush"):
+            self.sink.flush()
+
+# Sink that just collects what is written, for callers wanting a string back
+class StringSink:
+    """String sink"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+# Sink that gzip-compresses what is written as it goes, passing compressed data
+# on to file-like f.  level is the zlib compression level.  If flush_bytes is given,
+# compressed output is flushed through to f after each flush_bytes of input, so
+# the first parts of a document reach a reader before the rest is rendered
+class GzipSink:
+    """Gzip sink"""
+
+    def __init__(self, f, level=6, flush_bytes=None):
+        self.f = f
+        self.flush_bytes = flush_bytes
+        self.pending = 0
+        self.z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode("utf-8")
+        data = self.z.compress(s)
+        if data:
+            self.f.write(data)
+        if self.flush_bytes is not None:
+            self.pending += len(s)
+            if self.pending >= self.flush_bytes:
+                self.flush()
+
+    # Flush all compressed data so far through to f
+    def flush(self):
+        self.f.write(self.z.flush(zlib.Z_SYNC_FLUSH))
+        self.pending = 0
+        if hasattr(self.f, "flush"):
+            self.f.flush()
+
+    # Finish the gzip stream.  Does not close f
+    def close(self):
+        self.f.write(self.z.flush())
+        if hasattr(self.f, "flush"):
+            self.f.flush()
+
+# Sink that writes what is written to file-like f in HTTP chunked transfer
+# encoding, one chunk per write, flushing each through so a reader sees it at once
+class ChunkedSink:
+    """Chunked sink"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode("utf-8")
+        if not s:
+            return
+        self.f.write("%x\r\n%s\r\n" % (len(s), s))
+        self.flush()
+
+    def flush(self):
+        if hasattr(self.f, "flush"):
+            self.f.flush()
+
+    # Write the last chunk, ending the body.  Does not close f
+    def close(self):
+        self.f.write("0\r\n\r\n")
+        self.flush()
+
+# Get writer for output, which may be a writer already or a file-like sink
+def svg_writer(out):
+    if isinstance(out, SvgWriter):
+        return out
+    return SvgWriter(out)
 
 # Get coords string
 def st_coords(*args, **kwargs):
+    fmt = coord_formatter(kwargs.get("precision"))
     arr = []
     for c in args:
-        arr.append(str(c))
+        arr.append(str(fmt(c)))
     return " ".join(arr)
 
+# Get function to format coordinates to precision decimal places, with trailing
+# zeros and "." trimmed, e.g. 12.50 -> "12.5" and 3.0 -> "3".  Formatted values
+# are cached, as the same positions recur across bars and charts.  With precision
+# None, numbers are left as they are, to be output in full by str()
+_coord_formatters = {}
+_COORD_CACHE_SIZE = 10000
+
+def coord_formatter(precision):
+    if precision is None:
+        return _no_format
+    if precision in _coord_formatters:
+        return _coord_formatters[precision]
+    fmt = "%." + str(int(precision)) + "f"
+    cache = {}
+    def format_coord(v):
+        if v in cache:
+            return cache[v]
+        s = fmt % v
+        if "." in s:
+            s = s.rstrip("0").rstrip(".")
+        if s == "-0":
+            s = "0"
+        if len(cache) >= _COORD_CACHE_SIZE:
+            cache.clear()
+        cache[v] = s
+        return s
+    _coord_formatters[precision] = format_coord
+    return format_coord
+
+def _no_format(v):
+    return v
+
 # Concat args as strings                                                                                                                                        
 def scat(*args):
     return "".join(map(xstr, flatten(args)))